@@ -0,0 +1,148 @@
+from hashlib import md5
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+from recipes.versions import get_version, get_versions, user_version
+
+
+class ReferenceCache:
+    """
+    Справочник, сериализованный в JSON и хранящийся в памяти процесса.
+    Пересобирается, когда меняется версия набора данных.
+    """
+
+    def __init__(self, name, queryset, serializer_class):
+        self.name = name
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.entry = None
+
+    def get(self, version=None):
+        if version is None:
+            version = get_version(self.name)
+        if self.entry is None or self.entry[0] != version:
+            data = self.serializer_class(self.queryset.all(), many=True).data
+            self.entry = (version, data, JSONRenderer().render(data))
+        return self.entry
+
+    def get_data(self, version=None):
+        return self.get(version)[1]
+
+    def get_response(self, request):
+        version, data, content = self.get()
+        etag = f'"{self.name}-{version}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+def get_view_versions(view, names):
+    """
+    Версии для текущего запроса: все нужные представлению версии
+    читаются из БД одним запросом и запоминаются до конца запроса.
+    """
+    known = view.__dict__.setdefault('loaded_versions', {})
+    missing = [name for name in names if name not in known]
+    if missing:
+        known.update(zip(missing, get_versions(*missing)))
+    return [known[name] for name in names]
+
+
+class ConditionalGetMixin:
+    """
+    ETag для list и retrieve. Если клиент прислал актуальный ETag,
+    ответ 304 отдаётся без запросов к БД и сериализации.
+    """
+
+    etag_versions = ()
+
+    def get_etag_versions(self):
+        return self.etag_versions
+
+    def get_etag_parts(self, request):
+        names = list(self.get_etag_versions())
+        if request.user.is_authenticated:
+            names.append(user_version(request.user.id))
+        return [request.get_full_path(), *get_view_versions(self, names)]
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        parts = self.get_etag_parts(request)
+        if parts is None:
+            return handler(request, *args, **kwargs)
+        etag = quote_etag(md5(':'.join(map(str, parts)).encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class AnonymousListCacheMixin:
+    """
+    Кэш данных list для анонимных пользователей: их ответ не зависит
+    от того, кто спрашивает. Ключ строится по нормализованной строке
+    запроса и версиям cache_versions из БД, поэтому изменения данных
+    в любом процессе делают старые записи недоступными во всех.
+    Схема и хост тоже входят в ключ: в данных абсолютные URL картинок.
+    С LocMemCache у каждого процесса свой набор записей.
+    """
+
+    cache_alias = 'responses'
+    cache_versions = ()
+
+    def get_cache_versions(self):
+        return self.cache_versions
+
+    def get_list_cache_key(self, request):
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        parts = [
+            self.basename,
+            request.scheme,
+            request.get_host(),
+            repr(params),
+        ]
+        parts.extend(get_view_versions(self, self.get_cache_versions()))
+        return 'list:' + md5(':'.join(parts).encode()).hexdigest()
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        cache = caches[self.cache_alias]
+        key = self.get_list_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        return response
+
+
+tags_cache = ReferenceCache('tags', Tag.objects.all(), TagSerializer)
+ingredients_cache = ReferenceCache(
+    'ingredients', Ingredient.objects.all(), IngredientSerializer
+)
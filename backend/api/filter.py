@@ -1,10 +1,23 @@
+from django.db.models import Count, Exists, OuterRef
 from django_filters.rest_framework import FilterSet
 from django_filters.rest_framework.filters import (
+    BaseInFilter,
     BooleanFilter,
-    ModelMultipleChoiceFilter,
+    CharFilter,
+    ChoiceFilter,
+    NumberFilter,
 )
+from rest_framework.exceptions import ValidationError
 
-from recipes.models import Recipes, Tag
+from api.cache import get_view_versions, tags_cache
+from api.search import search_recipes
+from recipes.models import IngredientAmount, Recipes
+
+RecipeTag = Recipes.tags.through
+
+
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
 
 
 class RecipeFilter(FilterSet):
@@ -12,27 +25,83 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = BooleanFilter(
         field_name='is_in_shopping_cart', method='in_shopping_cart'
     )
-    tags = ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    tags = CharFilter(method='filter_tags')
+    tags_mode = ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='skip',
+    )
+    search = CharFilter(method='search_text')
+    cooking_time_min = NumberFilter(
+        field_name='cooking_time', lookup_expr='gte'
+    )
+    cooking_time_max = NumberFilter(
+        field_name='cooking_time', lookup_expr='lte'
     )
+    max_ingredients = NumberFilter(
+        field_name='ingredients_count', lookup_expr='lte'
+    )
+    exclude_ingredients = NumberInFilter(method='filter_exclude_ingredients')
 
     def favorited(self, queryset, name, value):
         user = self.request.user
         if not user.is_authenticated:
             return queryset
-        if value:
-            return queryset.filter(favorite_recipes__user=user)
-        return queryset.exclude(favorite_recipes__user=user)
+        return queryset.filter(is_favorited=value)
 
     def in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if not user.is_authenticated:
             return queryset
-        if value:
-            return queryset.filter(shopping_recipes__user=user)
-        return queryset.exclude(shopping_recipes__user=user)
+        return queryset.filter(is_in_shopping_cart=value)
+
+    def skip(self, queryset, name, value):
+        return queryset
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Слаги переводятся в id по кэшу тегов без запроса к БД.
+        tags_mode=any — EXISTS по таблице связи, all — GROUP BY ... HAVING.
+        Оба варианта не дублируют рецепты.
+        """
+        view = self.request.parser_context['view']
+        version, = get_view_versions(view, ['tags'])
+        tag_ids = {
+            tag['slug']: tag['id'] for tag in tags_cache.get_data(version)
+        }
+        slugs = set(self.data.getlist(name))
+        unknown = slugs - set(tag_ids)
+        if unknown:
+            raise ValidationError(
+                {name: [f'Тег {slug} не найден.' for slug in sorted(unknown)]}
+            )
+        ids = [tag_ids[slug] for slug in slugs]
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.filter(
+                id__in=RecipeTag.objects.filter(tag_id__in=ids)
+                .values('recipes_id')
+                .annotate(matched=Count('tag_id'))
+                .filter(matched=len(ids))
+                .values('recipes_id')
+            )
+        return queryset.filter(
+            Exists(
+                RecipeTag.objects.filter(
+                    recipes_id=OuterRef('pk'), tag_id__in=ids
+                )
+            )
+        )
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        return queryset.exclude(
+            Exists(
+                IngredientAmount.objects.filter(
+                    recipe=OuterRef('pk'), ingredient_id__in=value
+                )
+            )
+        )
+
+    def search_text(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
     class Meta:
         model = Recipes
@@ -0,0 +1,192 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+class PageLimitPagination(PageNumberPagination):
+    """
+    Постраничная пагинация с параметром limit и двумя дополнительными
+    режимами:
+    - ?cursor= — пагинация по ключу keyset_ordering без COUNT и OFFSET,
+      ссылка next содержит курсор следующей страницы;
+    - ?skip_count=1 — обычные страницы без запроса COUNT(*).
+    При keyset_only пагинация идёт по ключу, если порядок выдачи
+    совместим с keyset_ordering, иначе — обычными страницами.
+    """
+
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    skip_count_query_param = 'skip_count'
+    invalid_cursor_message = 'Неверный курсор.'
+    invalid_ordering_message = (
+        'Курсор нельзя использовать с выбранной сортировкой.'
+    )
+    keyset_ordering = None
+    keyset_only = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.mode = 'page'
+        cursor_requested = self.cursor_query_param in request.query_params
+        if self.keyset_ordering and (self.keyset_only or cursor_requested):
+            if self.is_keyset_ordering(queryset):
+                self.mode = 'keyset'
+                return self.paginate_keyset(queryset, request)
+            if cursor_requested:
+                raise ValidationError(
+                    {self.cursor_query_param: self.invalid_ordering_message}
+                )
+        skip_count = request.query_params.get(self.skip_count_query_param)
+        if skip_count and skip_count.lower() in TRUE_VALUES:
+            self.mode = 'skip_count'
+            return self.paginate_without_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def is_keyset_ordering(self, queryset):
+        """
+        Порядок представления (поиск, ?ordering= и т.п.) сохраняется,
+        только если он — начало keyset_ordering.
+        """
+        query = queryset.query
+        ordering = query.order_by
+        if not ordering and query.default_ordering:
+            ordering = queryset.model._meta.ordering
+        ordering = tuple(ordering)
+        return (
+            all(isinstance(field, str) for field in ordering)
+            and ordering == self.keyset_ordering[: len(ordering)]
+        )
+
+    def paginate_keyset(self, queryset, request):
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.keyset_ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor, queryset.model)
+            queryset = queryset.filter(self.get_keyset_filter(values))
+        page = list(queryset[: page_size + 1])
+        self.next_link = self.previous_link = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_link = replace_query_param(
+                request.build_absolute_uri(),
+                self.cursor_query_param,
+                self.encode_cursor(page[-1]),
+            )
+        return page
+
+    def paginate_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        try:
+            number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            number = 1
+        number = max(number, 1)
+        offset = (number - 1) * page_size
+        page = list(queryset[offset:offset + page_size + 1])
+        url = request.build_absolute_uri()
+        self.next_link = self.previous_link = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_link = replace_query_param(
+                url, self.page_query_param, number + 1
+            )
+        if number == 2:
+            self.previous_link = remove_query_param(url, self.page_query_param)
+        elif number > 2:
+            self.previous_link = replace_query_param(
+                url, self.page_query_param, number - 1
+            )
+        return page
+
+    def get_keyset_filter(self, values):
+        """(a, b) после (x, y): a после x или a = x и b после y."""
+        keyset_filter = Q()
+        for position, field in enumerate(self.keyset_ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{name}__{lookup}': values[position]})
+            previous = zip(self.keyset_ordering, values[:position])
+            for previous_field, value in previous:
+                condition &= Q(**{previous_field.lstrip('-'): value})
+            keyset_filter |= condition
+        return keyset_filter
+
+    def encode_cursor(self, instance):
+        values = []
+        for field in self.keyset_ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        """Значения курсора, приведённые к типам полей keyset_ordering."""
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(values, list)
+            or len(values) != len(self.keyset_ordering)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        parsed = []
+        for field, value in zip(self.keyset_ordering, values):
+            try:
+                value = model._meta.get_field(field.lstrip('-')).to_python(
+                    value
+                )
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            parsed.append(value)
+        return parsed
+
+    def get_next_link(self):
+        if self.mode == 'page':
+            return super().get_next_link()
+        return self.next_link
+
+    def get_previous_link(self):
+        if self.mode == 'page':
+            return super().get_previous_link()
+        return self.previous_link
+
+    def get_paginated_response(self, data):
+        if self.mode == 'page':
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict(
+                [
+                    ('count', None),
+                    ('next', self.get_next_link()),
+                    ('previous', self.get_previous_link()),
+                    ('results', data),
+                ]
+            )
+        )
+
+
+class RecipesPagination(PageLimitPagination):
+    keyset_ordering = ('-pub_date', '-id')
+
+
+class FeedPagination(RecipesPagination):
+    keyset_only = True
+
+
+class UsersPagination(PageLimitPagination):
+    keyset_ordering = ('username', 'id')
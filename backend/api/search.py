@@ -0,0 +1,225 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramSimilarity,
+)
+from django.db import connection
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Greatest, Length
+
+from api.cache import ingredients_cache
+from recipes.models import Ingredient, IngredientAmount, Recipes
+from recipes.versions import get_version
+
+WORD_RE = re.compile(r'\w+')
+ENDINGS = sorted(
+    (
+        'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+        'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ов',
+        'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'а', 'я', 'о', 'е', 'ы',
+        'и', 'у', 'ю', 'ь',
+    ),
+    key=len,
+    reverse=True,
+)
+RECIPE_WEIGHTS = (('name', 1.0), ('text', 0.4))
+
+
+class IngredientPrefixIndex:
+    """Отсортированный в памяти список ингредиентов для поиска по префиксу."""
+
+    def __init__(self, ingredients, version=None):
+        self.version = version
+        self.items = sorted(ingredients, key=lambda item: item['name'])
+        self.names = [item['name'] for item in self.items]
+
+    def search(self, prefix, limit):
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix + '\uffff', lo=start)
+        matches = sorted(
+            self.items[start:end], key=lambda item: len(item['name'])
+        )
+        return matches[:limit]
+
+
+_prefix_index = None
+
+
+def get_prefix_index():
+    global _prefix_index
+    version, data, content = ingredients_cache.get()
+    if _prefix_index is None or _prefix_index.version != version:
+        _prefix_index = IngredientPrefixIndex(data, version)
+    return _prefix_index
+
+
+def search_ingredients(name, limit=None):
+    """
+    Поиск ингредиентов для автодополнения.
+    Сначала совпадения по началу названия (короткие выше),
+    затем похожие названия: триграммы в PostgreSQL, вхождение подстроки
+    в остальных БД. Результат не длиннее INGREDIENT_SEARCH_LIMIT.
+    """
+    name = name.lower()
+    limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+    if settings.INGREDIENT_SEARCH_IN_MEMORY:
+        found = get_prefix_index().search(name, limit)
+    else:
+        found = list(
+            Ingredient.objects.filter(name__startswith=name)
+            .order_by(Length('name'), 'name')
+            .values('id', 'name', 'measurement_unit')[:limit]
+        )
+    if len(found) >= limit:
+        return found
+
+    similar = Ingredient.objects.exclude(name__startswith=name)
+    if connection.vendor == 'postgresql':
+        similar = (
+            similar.filter(
+                Q(name__trigram_similar=name) | Q(name__contains=name)
+            )
+            .annotate(similarity=TrigramSimilarity('name', name))
+            .order_by('-similarity', Length('name'))
+        )
+    else:
+        similar = similar.filter(name__contains=name).order_by(
+            Length('name'), 'name'
+        )
+    return found + list(
+        similar.values('id', 'name', 'measurement_unit')[: limit - len(found)]
+    )
+
+
+def stem(word):
+    """Грубое отсечение русских окончаний, основа не короче трёх букв."""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+def get_terms(text):
+    return [stem(word) for word in WORD_RE.findall(text.lower())]
+
+
+class RecipeTextIndex:
+    """
+    Обратный индекс основа -> {id рецепта: вес} для БД без полнотекстового
+    поиска. Вес повторяет ts_rank: название 1.0, описание 0.4.
+    """
+
+    def __init__(self, recipes, version=None):
+        self.version = version
+        self.terms = defaultdict(lambda: defaultdict(float))
+        for recipe in recipes:
+            for field, weight in RECIPE_WEIGHTS:
+                for term in get_terms(recipe[field]):
+                    self.terms[term][recipe['id']] += weight
+
+    def search(self, text):
+        """Рецепты, содержащие все слова запроса, и их ранг."""
+        ranks = None
+        for term in set(get_terms(text)):
+            found = self.terms.get(term, {})
+            if ranks is None:
+                ranks = dict(found)
+            else:
+                ranks = {
+                    recipe_id: rank + found[recipe_id]
+                    for recipe_id, rank in ranks.items()
+                    if recipe_id in found
+                }
+        return ranks or {}
+
+
+_recipe_index = None
+
+
+def get_recipe_index():
+    global _recipe_index
+    version = get_version('recipes')
+    if _recipe_index is None or _recipe_index.version != version:
+        _recipe_index = RecipeTextIndex(
+            Recipes.objects.values('id', 'name', 'text').iterator(), version
+        )
+    return _recipe_index
+
+
+def search_recipes(queryset, text):
+    """
+    Полнотекстовый поиск по названию и описанию, сортировка по рангу.
+    В PostgreSQL — search_vector и ts_rank, в остальных БД —
+    индекс RecipeTextIndex в памяти процесса.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            text, config=settings.SEARCH_CONFIG, search_type='websearch'
+        )
+        queryset = queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        )
+    else:
+        ranks = get_recipe_index().search(text)
+        queryset = queryset.filter(id__in=list(ranks)).annotate(
+            rank=Case(
+                *[
+                    When(id=recipe_id, then=Value(rank))
+                    for recipe_id, rank in ranks.items()
+                ],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+    return queryset.order_by('-rank', '-pub_date', '-id')
+
+
+def count_amounts(**filters):
+    return Subquery(
+        IngredientAmount.objects.filter(recipe=OuterRef('pk'), **filters)
+        .order_by()
+        .values('recipe')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+
+
+def search_by_ingredients(queryset, ingredient_ids, max_missing):
+    """
+    Рецепты, в которых есть хотя бы один из ингредиентов ingredient_ids
+    и не хватает не более max_missing. Кандидаты выбираются по индексу
+    (ingredient, recipe), сортировка по доле имеющихся ингредиентов.
+    Общее число ингредиентов берётся из Recipes.ingredients_count.
+    """
+    candidates = IngredientAmount.objects.filter(
+        ingredient_id__in=ingredient_ids
+    ).values('recipe_id')
+    return (
+        queryset.filter(id__in=candidates)
+        .annotate(
+            matched=count_amounts(ingredient_id__in=ingredient_ids),
+            total=Greatest('ingredients_count', 'matched'),
+        )
+        .annotate(missing=F('total') - F('matched'))
+        .filter(missing__lte=max_missing)
+        .annotate(
+            coverage=Cast('matched', FloatField())
+            / Cast('total', FloatField())
+        )
+        .order_by('-coverage', 'missing', '-matched', '-pub_date', '-id')
+    )
@@ -1,22 +1,36 @@
-import base64
+import binascii
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from PIL import Image
 from rest_framework.serializers import (
+    BooleanField,
+    FloatField,
     ImageField,
+    IntegerField,
+    ListField,
     ModelSerializer,
     PrimaryKeyRelatedField,
     ReadOnlyField,
+    Serializer,
     SerializerMethodField,
     ValidationError,
 )
 
+from api.utils import decode_base64
 from recipes.models import (
     Ingredient,
     IngredientAmount,
     Recipes,
     Tag,
 )
-from users.models import Follow, User
+from recipes.images import set_recipe_image
+from recipes.services import (
+    rebuild_carts_with_recipe,
+    refresh_ingredients_count,
+)
+from users.models import User
 
 
 class UserSerializer(ModelSerializer):
@@ -41,63 +55,11 @@ class UserSerializer(ModelSerializer):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
-        return Follow.objects.filter(user=user, following=obj).exists()
-
-
-class FollowSerializer(ModelSerializer):
-    id = ReadOnlyField(source='following.id')
-    email = ReadOnlyField(source='following.email')
-    username = ReadOnlyField(source='following.username')
-    first_name = ReadOnlyField(source='following.first_name')
-    last_name = ReadOnlyField(source='following.last_name')
-    is_subscribed = SerializerMethodField()
-    recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField()
-
-    class Meta:
-        model = User
-        fields = [
-            'email',
-            'id',
-            'username',
-            'first_name',
-            'last_name',
-            'is_subscribed',
-            'recipes',
-            'recipes_count',
-        ]
-
-    def validate(self, data):
-        author = self.context.get('author')
-        user = self.context.get('request').user
-
-        if user.follower.filter(following=author).first():
-            raise ValidationError('Вы уже подписаны на данного автора.')
-        if user == author:
-            raise ValidationError('Невозможно подписаться на самого себя.')
-        return data
-
-    def get_recipes_count(self, obj):
-        return Recipes.objects.filter(
-            author=self.context.get('author')
-        ).count()
-
-    def get_recipes(self, obj):
-        request = self.context.get('request')
-        author = obj.following
-        queryset = Recipes.objects.filter(author=author)
-        if 'recipes_limit' in request.query_params:
-            queryset = queryset[: int(request.query_params['recipes_limit'])]
-        serializer = FavoriteSerializer(
-            queryset, many=True, context={'request': request}
-        )
-        return serializer.data
-
-    def get_is_subscribed(self, obj):
-        """Проверка подписки юзера на автора."""
-        return Follow.objects.filter(
-            user=self.context.get('user'), following=self.context.get('author')
-        ).exists()
+        if 'subscriptions' not in self.context:
+            self.context['subscriptions'] = set(
+                user.follower.values_list('following_id', flat=True)
+            )
+        return obj.id in self.context['subscriptions']
 
 
 class TagSerializer(ModelSerializer):
@@ -132,12 +94,66 @@ class IngredientsAmountSerializer(ModelSerializer):
 
 
 class Base64ImageField(ImageField):
+    """
+    Изображение в виде data URI. Размер проверяется до декодирования,
+    размер в пикселях — по заголовку файла до распаковки изображения.
+    """
+
+    default_error_messages = {
+        **ImageField.default_error_messages,
+        'too_large': 'Размер файла не должен превышать {max_size} байт.',
+        'too_many_pixels': (
+            'Изображение не должно быть больше {max_pixels} пикселей.'
+        ),
+    }
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+        if not (isinstance(data, str) and data.startswith('data:image')):
+            return super().to_internal_value(data)
+        start = data.find(';base64,', 0, 100)
+        if start == -1:
+            self.fail('invalid_image')
+        start += len(';base64,')
+        if (len(data) - start) * 3 // 4 > settings.IMAGE_MAX_UPLOAD_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_MAX_UPLOAD_SIZE)
+        try:
+            file = decode_base64(data, start, settings.IMAGE_SPOOL_SIZE)
+        except (binascii.Error, ValueError):
+            self.fail('invalid_image')
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+                if width * height > settings.IMAGE_MAX_PIXELS:
+                    self.fail(
+                        'too_many_pixels',
+                        max_pixels=settings.IMAGE_MAX_PIXELS,
+                    )
+                image_format = image.format
+                image.verify()
+        except ValidationError:
+            file.close()
+            raise
+        except Image.DecompressionBombError:
+            file.close()
+            self.fail(
+                'too_many_pixels', max_pixels=settings.IMAGE_MAX_PIXELS
+            )
+        except Exception:
+            file.close()
+            self.fail('invalid_image')
+        file.seek(0)
+        return File(file, name=f'upload.{image_format.lower()}')
+
+
+class ThumbnailField(ImageField):
+    """Миниатюра; у рецептов без миниатюры отдаётся исходное фото."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return super().get_attribute(instance) or instance.image
 
 
 class RecipesSerializer(ModelSerializer):
@@ -145,8 +161,10 @@ class RecipesSerializer(ModelSerializer):
     ingredients = IngredientsAmountSerializer(many=True, source='recipe')
     author = UserSerializer(read_only=True)
     image = Base64ImageField(required=True)
-    is_favorited = SerializerMethodField()
-    is_in_shopping_cart = SerializerMethodField()
+    thumbnail_list = ThumbnailField()
+    thumbnail_detail = ThumbnailField()
+    is_favorited = BooleanField(read_only=True, default=False)
+    is_in_shopping_cart = BooleanField(read_only=True, default=False)
 
     class Meta:
         model = Recipes
@@ -159,25 +177,25 @@ class RecipesSerializer(ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'thumbnail_list',
+            'thumbnail_detail',
             'text',
             'cooking_time',
         )
 
-    def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.favorite_user.filter(recipe=obj).exists()
 
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.shopping_user.filter(recipe=obj).exists()
+class CookRecipesSerializer(RecipesSerializer):
+    """Рецепт с долей имеющихся ингредиентов и числом недостающих."""
+
+    coverage = FloatField(read_only=True)
+    missing = IntegerField(read_only=True)
+
+    class Meta(RecipesSerializer.Meta):
+        fields = RecipesSerializer.Meta.fields + ('coverage', 'missing')
 
 
 class IngredientsAmountCreateSerializer(ModelSerializer):
-    id = PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = IntegerField()
 
     class Meta:
         model = IngredientAmount
@@ -206,6 +224,21 @@ class RecipesCreateSerializer(ModelSerializer):
             'cooking_time',
         )
 
+    def validate_ingredients(self, ingredients):
+        """Все ингредиенты рецепта загружаются из БД одним запросом."""
+        found = Ingredient.objects.in_bulk(
+            [ingredient['id'] for ingredient in ingredients]
+        )
+        for ingredient in ingredients:
+            if ingredient['id'] not in found:
+                raise ValidationError(
+                    PrimaryKeyRelatedField.default_error_messages[
+                        'does_not_exist'
+                    ].format(pk_value=ingredient['id'])
+                )
+            ingredient['id'] = found[ingredient['id']]
+        return ingredients
+
     def update_or_create_ingredient(self, ingredients, recipe):
         temp_instances = []
         for ingredient in ingredients:
@@ -218,27 +251,65 @@ class RecipesCreateSerializer(ModelSerializer):
             )
         IngredientAmount.objects.bulk_create(temp_instances)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('recipe')
         user = self.context.get('request').user
         tags = validated_data.pop('tags')
-        recipe = Recipes.objects.create(author=user, **validated_data)
+        image = validated_data.pop('image')
+        recipe = Recipes(
+            author=user, ingredients_count=len(ingredients), **validated_data
+        )
+        set_recipe_image(recipe, image)
+        recipe.save()
         recipe.tags.set(tags)
         self.update_or_create_ingredient(ingredients, recipe)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        """
+        Приводит ингредиенты рецепта к новому списку тремя запросами:
+        добавление новых, изменение количества и удаление лишних.
+        Возвращает True, если что-то изменилось.
+        """
+        existing = {row.ingredient_id: row for row in recipe.recipe.all()}
+        created, changed = [], []
+        for ingredient in ingredients:
+            row = existing.pop(ingredient['id'].id, None)
+            if row is None:
+                created.append(
+                    IngredientAmount(
+                        ingredient=ingredient['id'],
+                        recipe=recipe,
+                        amount=ingredient['amount'],
+                    )
+                )
+            elif row.amount != ingredient['amount']:
+                row.amount = ingredient['amount']
+                changed.append(row)
+        if existing:
+            IngredientAmount.objects.filter(
+                id__in=[row.id for row in existing.values()]
+            ).delete()
+        IngredientAmount.objects.bulk_update(changed, ['amount'])
+        IngredientAmount.objects.bulk_create(created)
+        return bool(created or changed or existing)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags)
+        instance.tags.set(validated_data.pop('tags'))
         ingredients = validated_data.pop('recipe')
-        instance.ingredients.clear()
-        self.update_or_create_ingredient(ingredients, instance)
+        if self.update_ingredients(ingredients, instance):
+            refresh_ingredients_count([instance.id])
+            rebuild_carts_with_recipe(instance.id)
+        if 'image' in validated_data:
+            set_recipe_image(instance, validated_data.pop('image'))
         return super().update(instance, validated_data)
 
 
 class FavoriteSerializer(ModelSerializer):
     image = Base64ImageField(read_only=True)
+    thumbnail_list = ThumbnailField()
     name = ReadOnlyField()
     cooking_time = ReadOnlyField()
 
@@ -248,17 +319,65 @@ class FavoriteSerializer(ModelSerializer):
             'id',
             'name',
             'image',
+            'thumbnail_list',
             'cooking_time',
         )
 
-    def validate(self, attrs):
-        request = self.context.get('request')
-        user = self.initial_data.get('user')
-        recipe = self.initial_data.get('recipe')
-        if request.parser_context['view'].action == 'favorite':
-            if user.favorite_user.filter(recipe=recipe).first():
-                raise ValidationError('Рецепт уже есть в избранном')
-        if request.parser_context['view'].action == 'shopping_cart':
-            if user.shopping_user.filter(recipe=recipe).first():
-                raise ValidationError('Рецепт уже есть в списке покупок')
-        return attrs
+
+class FollowSerializer(UserSerializer):
+    """Сериализатор для автора в подписках пользователя."""
+
+    recipes = SerializerMethodField()
+    recipes_count = ReadOnlyField()
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
+        read_only_fields = fields
+
+    def get_recipes(self, obj):
+        serializer = FavoriteSerializer(
+            obj.recipes.all(), many=True, context=self.context
+        )
+        return serializer.data
+
+
+class BatchSerializer(Serializer):
+    """Список id для пакетного добавления или удаления."""
+
+    ids = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+class CookQuerySerializer(Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам."""
+
+    ingredients = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE,
+    )
+    max_missing = IntegerField(min_value=0, default=0)
+
+    def to_internal_value(self, data):
+        """ingredients=1,2&ingredients=3 превращается в [1, 2, 3]."""
+        ingredients = [
+            value
+            for values in data.getlist('ingredients')
+            for value in values.split(',')
+            if value
+        ]
+        return super().to_internal_value(
+            {
+                'ingredients': ingredients,
+                'max_missing': data.get('max_missing', 0),
+            }
+        )
+
+    def validate_ingredients(self, ingredients):
+        return list(dict.fromkeys(ingredients))
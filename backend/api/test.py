@@ -1,6 +1,38 @@
+import base64
+import binascii
+import json
+import os
+import shutil
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import SpooledTemporaryFile, TemporaryDirectory, mkdtemp
+from unittest.mock import Mock, patch
+
+from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-from recipes.models import Ingredient, Tag
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from api import search
+from api.cache import ingredients_cache, tags_cache
+from api.utils import decode_base64
+from recipes.admin import IngredientAmountAdmin
+from recipes.management.commands import _private as loader_module
+from recipes.models import (
+    DataVersion,
+    Ingredient,
+    IngredientAmount,
+    Recipes,
+    RecipeScore,
+    Tag,
+)
+from recipes.services import refresh_ingredients_count
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -15,6 +47,9 @@ from rest_framework.test import APIClient
 
 class FoodgramAPITestCase(TestCase):
     def setUp(self):
+        caches['responses'].clear()
+        tags_cache.entry = ingredients_cache.entry = None
+        search._prefix_index = search._recipe_index = None
         user = get_user_model()
         self.user = user.objects.create_user(
             username='auth_user',
@@ -184,7 +219,7 @@ class FoodgramAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_get_request(self):
-        ingredient = Ingredient.objects.create(
+        ingredient, _ = Ingredient.objects.get_or_create(
             name='трава',
             measurement_unit='кг',
         )
@@ -326,7 +361,7 @@ class FoodgramAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_ingidients(self):
-        ingredient = Ingredient.objects.create(
+        ingredient, _ = Ingredient.objects.get_or_create(
             name='трава',
             measurement_unit='кг',
         )
@@ -342,3 +377,1060 @@ class FoodgramAPITestCase(TestCase):
 
         response = self.non_client.get('/api/ingredients/1/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def create_recipes(self, count, author=None):
+        return [
+            Recipes.objects.create(
+                author=author or self.user2,
+                name=f'рецепт {number}',
+                image='food/temp.png',
+                text='описание',
+                cooking_time=10,
+            )
+            for number in range(count)
+        ]
+
+    def test_recipes_list_flags(self):
+        recipes = self.create_recipes(6)
+        self.user.favorite_user.create(recipe=recipes[0])
+        self.user.shopping_user.create(recipe=recipes[1])
+
+        # версии кэша, count, страница с флагами, два prefetch и подписки
+        with self.assertNumQueries(6), CaptureQueriesContext(
+            connection
+        ) as context:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        flags_queries = [
+            query['sql']
+            for query in context.captured_queries
+            if 'recipes_favoriterecipes' in query['sql']
+            or 'recipes_shoppingcart' in query['sql']
+        ]
+        self.assertEqual(
+            len(flags_queries),
+            2,
+            'флаги избранного и корзины должны считаться в основном запросе',
+        )
+
+        results = {
+            item['id']: item for item in response.json()['results']
+        }
+        self.assertTrue(results[recipes[0].id]['is_favorited'])
+        self.assertFalse(results[recipes[0].id]['is_in_shopping_cart'])
+        self.assertTrue(results[recipes[1].id]['is_in_shopping_cart'])
+        self.assertFalse(results[recipes[1].id]['is_favorited'])
+
+        response = self.client.get('/api/recipes/?is_favorited=1')
+        self.assertEqual(response.json()['count'], 1)
+        response = self.non_client.get('/api/recipes/?is_favorited=1')
+        self.assertEqual(response.json()['count'], 6)
+
+    def test_recipes_list_queries(self):
+        tag = Tag.objects.create(
+            name='Завтрак', color='#ffffff', slug='breakfast'
+        )
+        ingredient = Ingredient.objects.get(name='трава')
+        for recipe in self.create_recipes(6):
+            recipe.tags.add(tag)
+            recipe.recipe.create(ingredient=ingredient, amount=5)
+
+        for limit in (1, 2, 6):
+            with self.subTest(f'количество запросов для limit={limit}'):
+                # версии кэша, count, страница и два prefetch
+                with self.assertNumQueries(5):
+                    response = self.non_client.get(
+                        f'/api/recipes/?limit={limit}'
+                    )
+                self.assertEqual(len(response.json()['results']), limit)
+
+        with self.assertNumQueries(5):
+            response = self.non_client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.json()['tags'][0]['slug'], 'breakfast')
+        self.assertEqual(response.json()['ingredients'][0]['amount'], 5)
+
+    def test_is_subscribed_queries(self):
+        self.create_recipes(3)
+        self.create_recipes(3, author=self.user)
+        self.user.follower.create(following=self.user2)
+
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/')
+        subscribed = {
+            item['author']['id']: item['author']['is_subscribed']
+            for item in response.json()['results']
+        }
+        self.assertEqual(
+            subscribed, {self.user.id: False, self.user2.id: True}
+        )
+
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/users/')
+        self.assertEqual(
+            [user['is_subscribed'] for user in response.json()['results']],
+            [False, True],
+        )
+
+    def test_subscriptions_queries(self):
+        for number in range(3):
+            author = get_user_model().objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@utu.ru',
+                first_name='Автор',
+                last_name='Авторов',
+                password='Qwerty123123',
+            )
+            self.create_recipes(number + 1, author=author)
+            self.user.follower.create(following=author)
+
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2'
+            )
+        authors = response.json()['results']
+        self.assertEqual(
+            [author['recipes_count'] for author in authors], [1, 2, 3]
+        )
+        self.assertEqual(
+            [len(author['recipes']) for author in authors], [1, 2, 2]
+        )
+        self.assertTrue(all(author['is_subscribed'] for author in authors))
+
+        response = self.client.post(
+            f'/api/users/{self.user2.id}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.json()['recipes_count'], 0)
+        self.assertTrue(response.json()['is_subscribed'])
+
+    def test_download_shopping_cart_formats(self):
+        ingredient = Ingredient.objects.get(name='трава')
+        for recipe in self.create_recipes(2):
+            recipe.recipe.create(ingredient=ingredient, amount=5)
+            self.user.shopping_user.create(recipe=recipe)
+
+        expected = {
+            'txt': '| 1 | трава | 10 | кг |',
+            'csv': '1,трава,10,кг',
+            'json': '[{"name": "трава", "amount": 10, "measurement_unit": "кг"}]',
+        }
+        for file_format, row in expected.items():
+            with self.subTest(f'выгрузка в формате {file_format}'):
+                response = self.client.get(
+                    '/api/recipes/download_shopping_cart/'
+                    f'?format={file_format}'
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn(
+                    f'shopping_cart.{file_format}',
+                    response['Content-Disposition'],
+                )
+                content = b''.join(response.streaming_content).decode()
+                self.assertIn(row, content)
+
+        errors = (
+            (self.non_client, 'txt', status.HTTP_401_UNAUTHORIZED),
+            (self.non_client, 'csv', status.HTTP_401_UNAUTHORIZED),
+            (self.client, 'xml', status.HTTP_404_NOT_FOUND),
+        )
+        for client, file_format, status_code in errors:
+            with self.subTest(f'ошибка в JSON для {file_format}'):
+                response = client.get(
+                    '/api/recipes/download_shopping_cart/'
+                    f'?format={file_format}'
+                )
+                self.assertEqual(response.status_code, status_code)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('detail', response.json())
+
+    def test_shopping_cart_totals(self):
+        ingredient = Ingredient.objects.get(name='трава')
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        first, second = self.create_recipes(2, author=self.user)
+        first.recipe.create(ingredient=ingredient, amount=5)
+        second.recipe.create(ingredient=ingredient, amount=3)
+        second.recipe.create(ingredient=salt, amount=1)
+
+        def totals():
+            return dict(
+                self.user.shopping_ingredients.values_list(
+                    'ingredient__name', 'amount'
+                )
+            )
+
+        self.client.post(f'/api/recipes/{first.id}/shopping_cart/')
+        self.client.post(f'/api/recipes/{second.id}/shopping_cart/')
+        self.assertEqual(totals(), {'трава': 8, 'соль': 1})
+
+        response = self.client.patch(
+            f'/api/recipes/{second.id}/',
+            data={
+                'ingredients': [{'id': salt.id, 'amount': 2}],
+                'tags': [],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(totals(), {'трава': 5, 'соль': 2})
+
+        # сумма разошлась с рецептами: строка не уходит в минус
+        self.user.shopping_ingredients.filter(ingredient=ingredient).update(
+            amount=3
+        )
+        self.client.delete(f'/api/recipes/{first.id}/shopping_cart/')
+        self.assertEqual(totals(), {'соль': 2})
+
+        self.client.delete(f'/api/recipes/{second.id}/')
+        self.assertEqual(totals(), {})
+
+    def test_ingredients_search(self):
+        for name in ('травяной чай', 'мята', 'сушеная трава', 'травы'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+        for in_memory in (False, True):
+            with self.subTest(f'поиск в памяти: {in_memory}'):
+                with override_settings(
+                    INGREDIENT_SEARCH_IN_MEMORY=in_memory,
+                    INGREDIENT_SEARCH_LIMIT=4,
+                ):
+                    response = self.non_client.get(
+                        '/api/ingredients/?name=Трав'
+                    )
+                self.assertEqual(
+                    [item['name'] for item in response.json()],
+                    ['трава', 'травы', 'травяной чай', 'сушеная трава'],
+                )
+
+    def test_reference_cache(self):
+        response = self.non_client.get('/api/ingredients/')
+        etag = response['ETag']
+        self.assertEqual(len(response.json()), 1)
+
+        # только чтение версии справочника
+        with self.assertNumQueries(1):
+            response = self.non_client.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+        response = self.non_client.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_versions_shared_with_commands(self):
+        self.assertEqual(self.non_client.get('/api/tags/').json(), [])
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / 'tags.jsonl'
+            path.write_text(
+                '{"name": "ужин", "color": "#000000", "slug": "dinner"}\n'
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('load_db_from_json', str(path), stdout=StringIO())
+        self.assertTrue(
+            DataVersion.objects.filter(name='tags').exists(),
+            'версия хранится в БД, а не в кэше процесса',
+        )
+        response = self.non_client.get('/api/tags/')
+        self.assertEqual([tag['slug'] for tag in response.json()], ['dinner'])
+        response = self.non_client.get('/api/recipes/?tags=dinner')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_recipes_conditional_get(self):
+        first, second = self.create_recipes(2)
+        validator_queries = {
+            '/api/recipes/': 1,
+            f'/api/recipes/{first.id}/': 2,
+        }
+        etags = {url: self.client.get(url)['ETag'] for url in validator_queries}
+
+        for url, etag in etags.items():
+            with self.subTest(f'304 для {url}'):
+                with self.assertNumQueries(validator_queries[url]):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(
+                    response.status_code, status.HTTP_304_NOT_MODIFIED
+                )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{first.id}/favorite/')
+        for url, etag in etags.items():
+            with self.subTest(f'новый ETag после избранного для {url}'):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertNotEqual(response['ETag'], etag)
+
+        etag = self.non_client.get(f'/api/recipes/{first.id}/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            second.name = 'новое название'
+            second.save()
+        response = self.non_client.get(
+            f'/api/recipes/{first.id}/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_anonymous_recipes_list_cache(self):
+        tag = Tag.objects.create(
+            name='Завтрак', color='#ffffff', slug='breakfast'
+        )
+        recipe, *_ = self.create_recipes(3)
+        recipe.tags.add(tag)
+
+        response = self.non_client.get(
+            f'/api/recipes/?tags=breakfast&author={self.user2.id}'
+        )
+        self.assertEqual(response.json()['count'], 1)
+        # только чтение версий, без выборки рецептов
+        with self.assertNumQueries(1):
+            response = self.non_client.get(
+                f'/api/recipes/?author={self.user2.id}&tags=breakfast'
+            )
+        self.assertEqual(response.json()['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipes(1)[0].tags.add(tag)
+        response = self.non_client.get(
+            f'/api/recipes/?tags=breakfast&author={self.user2.id}'
+        )
+        self.assertEqual(response.json()['count'], 2)
+
+        url = f'/api/recipes/?author={self.user2.id}'
+        for secure, scheme in ((False, 'http'), (True, 'https')):
+            with self.subTest(scheme=scheme):
+                response = self.non_client.get(url, secure=secure)
+                self.assertTrue(
+                    response.json()['results'][0]['image'].startswith(
+                        f'{scheme}://testserver/'
+                    )
+                )
+
+    def test_keyset_pagination(self):
+        recipes = self.create_recipes(5)
+        url = '/api/recipes/?limit=2&cursor='
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.non_client.get(url)
+            self.assertFalse(
+                any('COUNT' in query['sql'] for query in context.captured_queries)
+            )
+            pages.append([item['id'] for item in response.json()['results']])
+            url = response.json()['next']
+        self.assertEqual(
+            pages,
+            [
+                [recipes[4].id, recipes[3].id],
+                [recipes[2].id, recipes[1].id],
+                [recipes[0].id],
+            ],
+        )
+
+        response = self.non_client.get('/api/recipes/?cursor=broken')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        forged = (
+            ['x', 'y'],
+            [None, None],
+            ['2020-01-01T00:00:00', 'z'],
+            [1, 2],
+            [{}, []],
+        )
+        for values in forged:
+            with self.subTest(cursor=values):
+                cursor = base64.urlsafe_b64encode(
+                    json.dumps(values).encode()
+                ).decode()
+                response = self.non_client.get(f'/api/recipes/?cursor={cursor}')
+                self.assertEqual(
+                    response.status_code, status.HTTP_404_NOT_FOUND
+                )
+
+        response = self.non_client.get(
+            '/api/recipes/?ordering=-favorites_count&cursor='
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.non_client.get('/api/users/?limit=1&cursor=')
+        self.assertEqual(
+            response.json()['results'][0]['username'], 'auth_user'
+        )
+        response = self.non_client.get(response.json()['next'])
+        self.assertEqual(
+            response.json()['results'][0]['username'], 'auth_user2'
+        )
+        self.assertIsNone(response.json()['next'])
+
+        response = self.non_client.get(
+            '/api/recipes/?limit=2&page=3&skip_count=1'
+        )
+        self.assertIsNone(response.json()['count'])
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_recipe_update_ingredients_diff(self):
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(8)
+        ]
+        recipe = self.create_recipes(1, author=self.user)[0]
+
+        def update(amounts):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.patch(
+                    f'/api/recipes/{recipe.id}/',
+                    data={
+                        'ingredients': [
+                            {'id': ingredient.id, 'amount': amount}
+                            for ingredient, amount in amounts
+                        ],
+                        'tags': [],
+                    },
+                    format='json',
+                )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(context.captured_queries)
+
+        update([(ingredient, 1) for ingredient in ingredients[:4]])
+        kept = set(
+            recipe.recipe.filter(ingredient__in=ingredients[:2]).values_list(
+                'id', flat=True
+            )
+        )
+
+        small = update(
+            [(ingredients[0], 1), (ingredients[1], 2), (ingredients[4], 1)]
+        )
+        large = update(
+            [(ingredients[0], 1), (ingredients[1], 3)]
+            + [(ingredient, 1) for ingredient in ingredients[5:]]
+        )
+        self.assertEqual(small, large)
+        self.assertEqual(
+            dict(recipe.recipe.values_list('ingredient__name', 'amount')),
+            {
+                'ингредиент 0': 1,
+                'ингредиент 1': 3,
+                'ингредиент 5': 1,
+                'ингредиент 6': 1,
+                'ингредиент 7': 1,
+            },
+        )
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            data={'ingredients': [{'id': 999, 'amount': 1}], 'tags': []},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            kept,
+            set(
+                recipe.recipe.filter(
+                    ingredient__in=ingredients[:2]
+                ).values_list('id', flat=True)
+            ),
+        )
+
+    def test_ingredient_amount_admin(self):
+        recipe, other = self.create_recipes(2)
+        ingredients = [
+            Ingredient.objects.get(),
+            Ingredient.objects.create(name='соль', measurement_unit='г'),
+        ]
+        amounts = [
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+            for ingredient, amount in zip(ingredients, (1, 2))
+        ]
+        model_admin = IngredientAmountAdmin(IngredientAmount, admin.site)
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        Recipes.objects.update(
+            update_date=timezone.now() - timedelta(days=1)
+        )
+        etag = self.non_client.get('/api/recipes/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            model_admin.delete_queryset(
+                None, IngredientAmount.objects.filter(id=amounts[0].id)
+            )
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredients_count, 1)
+        self.assertGreater(
+            recipe.update_date, timezone.now() - timedelta(hours=1)
+        )
+        response = self.non_client.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(self.user.shopping_ingredients.values_list('amount', flat=True)),
+            [2],
+        )
+
+        amounts[1].recipe = other
+        form = Mock(initial={'recipe': recipe.id})
+        model_admin.save_model(None, amounts[1], form, True)
+        self.assertEqual(
+            dict(Recipes.objects.values_list('id', 'ingredients_count')),
+            {recipe.id: 0, other.id: 1},
+        )
+        self.assertFalse(self.user.shopping_ingredients.exists())
+
+    def test_favorite_toggle_queries(self):
+        recipe = self.create_recipes(1)[0]
+        url = f'/api/recipes/{recipe.id}/favorite/'
+
+        def statements(method):
+            with CaptureQueriesContext(connection) as context:
+                response = method(url)
+            sql = [
+                query['sql']
+                for query in context.captured_queries
+                if 'SAVEPOINT' not in query['sql']
+            ]
+            return response, sql
+
+        response, sql = statements(self.client.post)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['name'], recipe.name)
+        self.assertEqual(len(sql), 3, 'рецепт, вставка и счётчик')
+
+        response, sql = statements(self.client.post)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(sql), 2)
+
+        response, sql = statements(self.client.delete)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len(sql), 3)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.user.favorite_user.exists())
+
+    def test_counters(self):
+        recipes = self.create_recipes(3)
+        self.client.post(f'/api/recipes/{recipes[0].id}/favorite/')
+        self.client2.post(f'/api/recipes/{recipes[0].id}/favorite/')
+        self.client.post(f'/api/recipes/{recipes[1].id}/favorite/')
+        self.client.post(f'/api/recipes/{recipes[1].id}/shopping_cart/')
+        self.client.post(f'/api/users/{self.user2.id}/subscribe/')
+        self.client2.delete(f'/api/recipes/{recipes[0].id}/favorite/')
+        self.user2.favorite_user.create(recipe=recipes[2])
+
+        response = self.non_client.get('/api/recipes/?ordering=-favorites_count')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [recipes[2].id, recipes[1].id, recipes[0].id],
+        )
+        counters = dict(Recipes.objects.values_list('id', 'favorites_count'))
+        self.assertEqual(
+            counters, {recipes[0].id: 1, recipes[1].id: 1, recipes[2].id: 1}
+        )
+        recipes[1].refresh_from_db()
+        self.assertEqual(recipes[1].shopping_count, 1)
+        self.user2.refresh_from_db()
+        self.assertEqual(
+            (self.user2.followers_count, self.user2.recipes_count), (1, 3)
+        )
+
+        Recipes.objects.update(favorites_count=0)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(
+            dict(Recipes.objects.values_list('id', 'favorites_count')),
+            counters,
+        )
+
+    def test_counter_ordering_etag(self):
+        first, second = self.create_recipes(2)
+        url = '/api/recipes/?ordering=-favorites_count'
+        etag = self.client.get(url)['ETag']
+        anonymous = self.non_client.get(url).json()['results']
+        self.assertEqual(anonymous[0]['id'], second.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client2.post(f'/api/recipes/{first.id}/favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['id'], first.id)
+        anonymous = self.non_client.get(url).json()['results']
+        self.assertEqual(anonymous[0]['id'], first.id)
+
+        counters = DataVersion.objects.get(name='counters').version
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client2.post(f'/api/recipes/{first.id}/shopping_cart/')
+            self.client2.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(
+            DataVersion.objects.get(name='counters').version,
+            counters,
+            'от счётчиков корзины и подписчиков порядок списков не зависит',
+        )
+
+    def test_save_keeps_counters(self):
+        recipe, = self.create_recipes(1)
+        stale_recipe = Recipes.objects.get(id=recipe.id)
+        stale_user = get_user_model().objects.get(id=self.user2.id)
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.client.post(f'/api/users/{self.user2.id}/subscribe/')
+
+        stale_recipe.name = 'новое название'
+        stale_recipe.save()
+        stale_user.first_name = 'Новое имя'
+        stale_user.save()
+        recipe.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(recipe.name, 'новое название')
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_count), (1, 1)
+        )
+        self.assertEqual(self.user2.first_name, 'Новое имя')
+        self.assertEqual(self.user2.followers_count, 1)
+
+    def test_trending(self):
+        old, fresh, cart = self.create_recipes(3)
+        for client in (self.client, self.client2):
+            client.post(f'/api/recipes/{old.id}/favorite/')
+        self.client.post(f'/api/recipes/{fresh.id}/favorite/')
+        self.client.post(f'/api/recipes/{cart.id}/shopping_cart/')
+        self.user.favorite_user.filter(recipe=old).update(
+            created=timezone.now() - timedelta(days=10)
+        )
+        self.user2.favorite_user.filter(recipe=old).update(
+            created=timezone.now() - timedelta(days=30)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('refresh_trending', stdout=StringIO())
+        response = self.non_client.get('/api/recipes/trending/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [cart.id, fresh.id, old.id],
+            'покупка весит больше, старые события затухают',
+        )
+        self.assertLess(
+            RecipeScore.objects.get(recipe=old).score, 0.2,
+            'событие за пределами окна не учитывается',
+        )
+
+    def test_feed(self):
+        user = get_user_model()
+        author = user.objects.create_user(
+            username='author3', email='author3@utu.ru', password='Qwe12312'
+        )
+        own = self.create_recipes(2, author=self.user2)
+        other = self.create_recipes(2, author=author)
+        self.create_recipes(1, author=self.user)
+        self.client.post(f'/api/users/{self.user2.id}/subscribe/')
+        self.client.post(f'/api/users/{author.id}/subscribe/')
+        expected = sorted(
+            own + other, key=lambda recipe: (recipe.pub_date, recipe.id)
+        )[::-1]
+
+        ids, url = [], '/api/recipes/feed/?limit=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIsNone(response.json()['count'])
+            ids += [item['id'] for item in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(ids, [recipe.id for recipe in expected])
+
+        # сортировка не совпадает с ключом — обычные страницы
+        response = self.client.get('/api/recipes/feed/?ordering=pub_date')
+        self.assertEqual(response.json()['count'], 4)
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [recipe.id for recipe in expected[::-1]],
+        )
+
+        response = self.non_client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def use_temporary_media_root(self):
+        """Файлы теста пишутся во временный MEDIA_ROOT и удаляются."""
+        media_root = mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def image_payload(self, size, image_format='PNG', color='red', **params):
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, image_format, **params)
+        content = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/{image_format.lower()};base64,{content}'
+
+    def test_recipe_image_processing(self):
+        self.use_temporary_media_root()
+        exif = Image.Exif()
+        exif[0x010F] = 'camera'
+        data = {
+            'ingredients': [{'id': Ingredient.objects.first().id, 'amount': 1}],
+            'tags': [],
+            'image': self.image_payload((3000, 1500), 'JPEG', exif=exif),
+            'name': 'фото',
+            'text': 'описание',
+            'cooking_time': 5,
+        }
+        response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipes.objects.get(name='фото')
+        sizes = {
+            'image': (1600, 800),
+            'thumbnail_list': (480, 240),
+            'thumbnail_detail': (960, 480),
+        }
+        for field, size in sizes.items():
+            file = getattr(recipe, field)
+            self.assertTrue(file.name.endswith('.webp'), file.name)
+            with Image.open(file.path) as image:
+                self.assertEqual(image.size, size)
+                self.assertFalse(image.getexif(), 'метаданные удалены')
+
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertTrue(
+            response.json()['thumbnail_list'].endswith(
+                recipe.thumbnail_list.url
+            )
+        )
+        old = self.create_recipes(1)[0]
+        response = self.client.get(f'/api/recipes/{old.id}/')
+        self.assertTrue(
+            response.json()['thumbnail_list'].endswith(old.image.url),
+            'без миниатюры отдаётся исходное фото',
+        )
+
+    def test_recipe_image_limits(self):
+        self.use_temporary_media_root()
+        data = {
+            'ingredients': [{'id': Ingredient.objects.first().id, 'amount': 1}],
+            'tags': [],
+            'name': 'фото',
+            'text': 'описание',
+            'cooking_time': 5,
+        }
+        cases = (
+            (self.image_payload((200, 200)), {'IMAGE_MAX_UPLOAD_SIZE': 100}),
+            (self.image_payload((200, 200)), {'IMAGE_MAX_PIXELS': 1000}),
+            ('data:image/png;base64,iVBORw0KGgo=', {}),
+            ('data:image/png;base64,не base64', {}),
+        )
+        for image, limits in cases:
+            with self.subTest(limits=limits), override_settings(**limits):
+                response = self.client.post(
+                    '/api/recipes/', {**data, 'image': image}, format='json'
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+                self.assertIn('image', response.json())
+        self.assertFalse(Recipes.objects.exists())
+
+        with override_settings(IMAGE_SPOOL_SIZE=100):
+            response = self.client.post(
+                '/api/recipes/',
+                {**data, 'image': self.image_payload((200, 200))},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        files = []
+
+        def spooled_file(**kwargs):
+            files.append(SpooledTemporaryFile(**kwargs))
+            return files[-1]
+
+        with patch('api.utils.SpooledTemporaryFile', spooled_file):
+            for payload in ('QUJD' * 2048 + 'QUJ*', 'QUJDR'):
+                with self.assertRaises(binascii.Error):
+                    decode_base64(payload, 0, 100)
+        self.assertTrue(all(file.closed for file in files))
+
+    def test_content_addressed_images(self):
+        self.use_temporary_media_root()
+        data = {
+            'ingredients': [{'id': Ingredient.objects.first().id, 'amount': 1}],
+            'tags': [],
+            'image': self.image_payload((64, 64)),
+            'text': 'описание',
+            'cooking_time': 5,
+        }
+        for name in ('первый', 'второй'):
+            response = self.client.post(
+                '/api/recipes/', {**data, 'name': name}, format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        first, second = Recipes.objects.order_by('id')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^food/[0-9a-f]{2}/[0-9a-f]{64}')
+
+        data['image'] = self.image_payload((64, 64), color='blue')
+        response = self.client.patch(
+            f'/api/recipes/{second.id}/',
+            {**data, 'name': 'второй'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first.delete()
+        orphan = first.thumbnail_list.path
+        self.assertTrue(os.path.exists(orphan))
+        call_command('clean_media', min_age=0, stdout=StringIO())
+        self.assertFalse(os.path.exists(orphan))
+        second.refresh_from_db()
+        self.assertTrue(os.path.exists(second.thumbnail_list.path))
+
+    def test_recipes_search(self):
+        soup, salad, cake = self.create_recipes(3)
+        Recipes.objects.filter(id=soup.id).update(
+            name='Борщ с говядиной', text='Свёкла, капуста и говядина'
+        )
+        Recipes.objects.filter(id=salad.id).update(
+            name='Салат', text='Тёплый салат с говядиной'
+        )
+        Recipes.objects.filter(id=cake.id).update(
+            name='Торт', text='Бисквитный торт'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipes.objects.get(id=cake.id).save()
+
+        response = self.non_client.get('/api/recipes/?search=говядина')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [soup.id, salad.id],
+            'совпадение в названии ранжируется выше',
+        )
+        response = self.non_client.get('/api/recipes/?search=салат говядины')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']], [salad.id]
+        )
+        response = self.non_client.get('/api/recipes/?search=пицца')
+        self.assertEqual(response.json()['results'], [])
+
+    def test_cook(self):
+        egg, milk, flour, sugar = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('яйцо', 'молоко', 'мука', 'сахар')
+        )
+        omelette, pancakes, cake = self.create_recipes(3)
+        for recipe, ingredients in (
+            (omelette, (egg, milk)),
+            (pancakes, (egg, milk, flour)),
+            (cake, (egg, flour, sugar, milk)),
+        ):
+            for ingredient in ingredients:
+                recipe.recipe.create(ingredient=ingredient, amount=1)
+        refresh_ingredients_count([omelette.id, pancakes.id, cake.id])
+
+        url = f'/api/recipes/cook/?ingredients={egg.id},{milk.id}'
+        response = self.non_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [omelette.id],
+        )
+        response = self.non_client.get(
+            f'{url}&ingredients={flour.id}&max_missing=1'
+        )
+        results = response.json()['results']
+        self.assertEqual(
+            [(item['id'], item['missing']) for item in results],
+            [(pancakes.id, 0), (omelette.id, 0), (cake.id, 1)],
+        )
+        self.assertEqual(results[2]['coverage'], 0.75)
+
+        response = self.non_client.get('/api/recipes/cook/?ingredients=x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tags_filter_modes(self):
+        breakfast, lunch = (
+            Tag.objects.create(name=slug, color='#FFFFFF', slug=slug)
+            for slug in ('breakfast', 'lunch')
+        )
+        both, morning, day = self.create_recipes(3)
+        both.tags.add(breakfast, lunch)
+        morning.tags.add(breakfast)
+        day.tags.add(lunch)
+        self.create_recipes(1)
+        tags_cache.get_data()
+
+        url = '/api/recipes/?tags=breakfast&tags=lunch'
+        # версии, count, страница и два prefetch; слаги проверяются по кэшу
+        with self.assertNumQueries(5):
+            response = self.non_client.get(url)
+        self.assertEqual(
+            sorted(item['id'] for item in response.json()['results']),
+            [both.id, morning.id, day.id],
+            'каждый рецепт один раз',
+        )
+        self.assertEqual(response.json()['count'], 3)
+        response = self.non_client.get(f'{url}&tags_mode=all')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']], [both.id]
+        )
+        response = self.non_client.get('/api/recipes/?tags=dinner')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.non_client.get(f'{url}&tags_mode=some')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_range_filters(self):
+        egg, milk, flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('яйцо', 'молоко', 'мука')
+        )
+        data = {
+            'tags': [],
+            'image': self.image_payload((8, 8)),
+            'text': 'описание',
+        }
+        for name, cooking_time, ingredients in (
+            ('быстрый', 5, (egg,)),
+            ('средний', 30, (egg, milk)),
+            ('долгий', 90, (egg, milk, flour)),
+        ):
+            response = self.client.post(
+                '/api/recipes/',
+                {
+                    **data,
+                    'name': name,
+                    'cooking_time': cooking_time,
+                    'ingredients': [
+                        {'id': ingredient.id, 'amount': 1}
+                        for ingredient in ingredients
+                    ],
+                },
+                format='json',
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipes.objects.get(name='средний')
+        self.assertEqual(recipe.ingredients_count, 2)
+
+        def names(query):
+            response = self.non_client.get(f'/api/recipes/?{query}')
+            return {item['name'] for item in response.json()['results']}
+
+        self.assertEqual(
+            names('cooking_time_min=10&cooking_time_max=60'), {'средний'}
+        )
+        self.assertEqual(names('max_ingredients=2'), {'быстрый', 'средний'})
+        self.assertEqual(
+            names(f'exclude_ingredients={milk.id},{flour.id}'), {'быстрый'}
+        )
+
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {
+                **data,
+                'name': 'средний',
+                'cooking_time': 30,
+                'ingredients': [{'id': egg.id, 'amount': 2}],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredients_count, 1)
+
+    def test_load_db_from_json(self):
+        data = settings.BASE_DIR / 'data'
+        paths = [str(data / 'ingredients.json'), str(data / 'tags.json')]
+        for _ in range(2):
+            call_command('load_db_from_json', *paths, stdout=StringIO())
+        loaded = json.loads((data / 'ingredients.json').read_text())
+        self.assertEqual(
+            Ingredient.objects.count(),
+            len(loaded) + 1,
+            'повторный запуск без дублей, ингредиент из setUp сохранён',
+        )
+        self.assertEqual(Tag.objects.count(), 3)
+
+        with TemporaryDirectory() as directory:
+            directory = Path(directory)
+            (directory / 'tags.jsonl').write_text(
+                '{"name": "завтрак", "color": "#FFFFFF", "slug": "recipe"}\n'
+            )
+            (directory / 'ingredients_extra.csv').write_text(
+                'трава,кг\nсоль,г\nсоль,г\n'
+            )
+            call_command(
+                'load_db_from_json',
+                str(directory / 'tags.jsonl'),
+                str(directory / 'ingredients_extra.csv'),
+                batch_size=1,
+                stdout=StringIO(),
+            )
+        self.assertEqual(Tag.objects.get(slug='recipe').name, 'завтрак')
+        self.assertEqual(Ingredient.objects.filter(name='соль').count(), 1)
+
+        items = [{'name': f'ингредиент {number}'} for number in range(50)]
+        with patch.object(loader_module, 'JSON_CHUNK_SIZE', 7):
+            parsed = list(
+                loader_module.iter_json_array(StringIO(json.dumps(items)))
+            )
+        self.assertEqual(parsed, items)
+
+    def test_batch_endpoints(self):
+        ingredient = Ingredient.objects.get(name='трава')
+        recipes = self.create_recipes(3)
+        for recipe in recipes:
+            recipe.recipe.create(ingredient=ingredient, amount=2)
+        self.user.favorite_user.create(recipe=recipes[0])
+        ids = [recipe.id for recipe in recipes] + [999]
+
+        response = self.client.post(
+            '/api/recipes/favorite/', data={'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['exists', 'created', 'created', 'not_found'],
+        )
+        self.assertEqual(self.user.favorite_user.count(), 3)
+
+        response = self.client.delete(
+            '/api/recipes/favorite/', data={'ids': ids[:2]}, format='json'
+        )
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['deleted', 'deleted'],
+        )
+
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', data={'ids': ids}, format='json'
+        )
+        self.assertEqual(
+            dict(self.user.shopping_ingredients.values_list(
+                'ingredient__name', 'amount')),
+            {'трава': 6},
+        )
+        response = self.client.delete(
+            '/api/recipes/shopping_cart/', data={'ids': ids[1:]},
+            format='json'
+        )
+        self.assertEqual(
+            dict(self.user.shopping_ingredients.values_list(
+                'ingredient__name', 'amount')),
+            {'трава': 2},
+        )
+
+        response = self.client.post(
+            '/api/users/subscribe/',
+            data={'ids': [self.user.id, self.user2.id]},
+            format='json',
+        )
+        self.assertEqual(
+            response.json()['results'],
+            [
+                {'id': self.user.id, 'status': 'not_found'},
+                {'id': self.user2.id, 'status': 'created'},
+            ],
+        )
+
+        response = self.client.post(
+            '/api/recipes/favorite/', data={'ids': []}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
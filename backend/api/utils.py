@@ -1,24 +1,132 @@
-from django.http import FileResponse
-from tabulate import tabulate
+import binascii
+import csv
+import json
+from base64 import b64decode
+from tempfile import SpooledTemporaryFile
 
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
 
-def get_shopping_ingredient(ingredients):
-    head = ["No.", "Наименование", "Количество", "Ед.изм."]
-    data = []
+SHOPPING_CART_HEAD = ('No.', 'Наименование', 'Количество', 'Ед.изм.')
+SHOPPING_CART_CHUNK_SIZE = 2000
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+class Echo:
+    """Файлоподобный объект для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def get_shopping_rows(ingredients):
+    """Строки списка покупок, читаемые из БД курсором по частям."""
+    ingredients = ingredients.iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE)
     for count, ingredient in enumerate(ingredients, start=1):
-        data.append(
-            [
-                str(count),
-                ingredient['ingredient__name'],
-                str(ingredient['amount_sum']),
-                ingredient['ingredient__measurement_unit'],
-            ]
+        yield (
+            count,
+            ingredient['ingredient__name'],
+            ingredient['amount_sum'],
+            ingredient['ingredient__measurement_unit'],
+        )
+
+
+def stream_txt(rows):
+    yield '| ' + ' | '.join(SHOPPING_CART_HEAD) + ' |\n'
+    yield '|' + '|'.join('---' for _ in SHOPPING_CART_HEAD) + '|\n'
+    for row in rows:
+        yield '| ' + ' | '.join(str(value) for value in row) + ' |\n'
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(SHOPPING_CART_HEAD)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_json(rows):
+    separator = '['
+    for count, name, amount, measurement_unit in rows:
+        yield separator + json.dumps(
+            {
+                'name': name,
+                'amount': amount,
+                'measurement_unit': measurement_unit,
+            },
+            ensure_ascii=False,
         )
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+SHOPPING_CART_FORMATS = {
+    'txt': stream_txt,
+    'csv': stream_csv,
+    'json': stream_json,
+}
+
 
-    table = tabulate(data, headers=head, tablefmt="github")
-    return FileResponse(
-        table,
-        content_type='text/plain',
-        as_attachment=True,
-        filename="shopping_cart.txt",
+def get_shopping_ingredient(ingredients, renderer):
+    """Потоковая выгрузка списка покупок в формате выбранного рендерера."""
+    stream = SHOPPING_CART_FORMATS[renderer.format]
+    response = StreamingHttpResponse(
+        stream(get_shopping_rows(ingredients)),
+        content_type=f'{renderer.media_type}; charset=utf-8',
     )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_cart.{renderer.format}"'
+    )
+    return response
+
+
+def get_batch_response(request, ids, found, create, delete):
+    """
+    Пакетное добавление (POST) или удаление (DELETE) связей пользователя
+    в одной транзакции. Для каждого id возвращается свой статус.
+    """
+    valid_ids = [pk for pk in ids if pk in found]
+    if request.method == 'POST':
+        done_status, skipped_status, action = 'created', 'exists', create
+    else:
+        done_status, skipped_status, action = 'deleted', 'absent', delete
+    with transaction.atomic():
+        done = set(action(request.user.id, valid_ids))
+    results = []
+    for pk in ids:
+        if pk not in found:
+            item_status = 'not_found'
+        elif pk in done:
+            item_status = done_status
+        else:
+            item_status = skipped_status
+        results.append({'id': pk, 'status': item_status})
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+def decode_base64(data, start, spool_size):
+    """
+    Декодирует base64 из data начиная с позиции start частями
+    по BASE64_CHUNK_SIZE символов во временный файл, который
+    остаётся в памяти до spool_size байт. Пробелы и переводы строк
+    пропускаются. При неверных данных бросает binascii.Error.
+    """
+    file = SpooledTemporaryFile(max_size=spool_size)
+    rest = ''
+    try:
+        for position in range(start, len(data), BASE64_CHUNK_SIZE):
+            chunk = rest + ''.join(
+                data[position:position + BASE64_CHUNK_SIZE].split()
+            )
+            end = len(chunk) - len(chunk) % 4
+            file.write(b64decode(chunk[:end], validate=True))
+            rest = chunk[end:]
+        if rest:
+            raise binascii.Error('Неполный блок base64.')
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return file
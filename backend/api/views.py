@@ -1,17 +1,43 @@
-from django.db.models import Sum
+from django.db.models import (
+    BooleanField,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Value,
+)
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import TokenCreateView, UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
+from api.cache import (
+    AnonymousListCacheMixin,
+    ConditionalGetMixin,
+    ingredients_cache,
+    tags_cache,
+)
 from api.filter import RecipeFilter
+from api.pagination import (
+    FeedPagination,
+    PageLimitPagination,
+    RecipesPagination,
+    UsersPagination,
+)
 from api.permissions import IsAuthorOrReadOnly
+from api.renderers import CSVRenderer, PlainTextRenderer
+from api.search import search_by_ingredients, search_ingredients
 from api.serializers import (
+    BatchSerializer,
+    CookQuerySerializer,
+    CookRecipesSerializer,
     FavoriteSerializer,
     FollowSerializer,
     IngredientSerializer,
@@ -20,13 +46,24 @@ from api.serializers import (
     TagSerializer,
     UserSerializer,
 )
-from api.utils import get_shopping_ingredient
+from api.utils import get_batch_response, get_shopping_ingredient
 from recipes.models import (
+    FavoriteRecipes,
     Ingredient,
     IngredientAmount,
     Recipes,
+    ShoppingCart,
     Tag,
 )
+from recipes.services import (
+    ORDERING_COUNTERS,
+    add_favorites,
+    add_follows,
+    add_to_shopping_cart,
+    remove_favorites,
+    remove_follows,
+    remove_from_shopping_cart,
+)
 from users.models import Follow, User
 
 
@@ -37,12 +74,12 @@ class CustomTokenCreateView(TokenCreateView):
         return response
 
 
-class UserViewSet(UserViewSet):
+class UserViewSet(ConditionalGetMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     lookup_field = 'id'
-    pagination_class = PageNumberPagination
-    pagination_class.page_size_query_param = 'limit'
+    pagination_class = UsersPagination
+    etag_versions = ('users',)
 
     @action(
         detail=False,
@@ -53,6 +90,22 @@ class UserViewSet(UserViewSet):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def get_authors_queryset(self):
+        """Авторы с количеством рецептов и первыми recipes_limit рецептами."""
+        recipes = Recipes.objects.all()
+        limit = self.request.query_params.get('recipes_limit', '')
+        if limit.isdigit():
+            recipes = recipes.filter(
+                id__in=Subquery(
+                    Recipes.objects.filter(author=OuterRef('author')).values(
+                        'id'
+                    )[: int(limit)]
+                )
+            )
+        return User.objects.prefetch_related(
+            Prefetch('recipes', queryset=recipes)
+        ).order_by('username')
+
     @action(
         detail=False,
         methods=['GET'],
@@ -60,7 +113,7 @@ class UserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = self.request.user
-        queryset = Follow.objects.filter(user=user)
+        queryset = self.get_authors_queryset().filter(following__user=user)
         page = self.paginate_queryset(queryset)
         serializer = FollowSerializer(
             page, many=True, context={'request': request}
@@ -75,46 +128,82 @@ class UserViewSet(UserViewSet):
     )
     def subscribe(self, request, **kwargs):
         user = self.request.user
-        author = get_object_or_404(User, id=kwargs['id'])
+        author = get_object_or_404(User.objects.only('id'), id=kwargs['id'])
         if request.method == 'POST':
+            if user.id == author.id:
+                return Response(
+                    {'error': ['Невозможно подписаться на самого себя.']},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if not add_follows(user.id, [author.id]):
+                return Response(
+                    {'error': ['Вы уже подписаны на данного автора.']},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
             serializer = FollowSerializer(
-                data=self.request.data,
-                context={'user': user, 'author': author, 'request': request},
+                self.get_authors_queryset().get(id=author.id),
+                context={'request': request},
             )
-            if serializer.is_valid(raise_exception=True):
-                serializer.instance = user.follower.create(following=author)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if not user.follower.filter(following=author).first():
+        if not remove_follows(user.id, [author.id]):
             return Response(
                 {'errors': ['Вы не были подписаны на автора.']},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        user.follower.get(following=author).delete()
         return Response(
             'Вы успешно отписались от автора.',
             status=status.HTTP_204_NO_CONTENT,
         )
 
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        permission_classes=(IsAuthenticated,),
+        url_path='subscribe',
+        url_name='subscribe-batch',
+    )
+    def subscribe_batch(self, request):
+        user = self.request.user
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found = set(
+            User.objects.filter(id__in=ids)
+            .exclude(id=user.id)
+            .values_list('id', flat=True)
+        )
+        return get_batch_response(
+            request, ids, found, add_follows, remove_follows
+        )
+
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    etag_versions = ('tags',)
 
+    def list(self, request, *args, **kwargs):
+        return tags_cache.get_response(request)
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+
+class IngredientViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
+    etag_versions = ('ingredients',)
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        name = self.request.query_params.get('name', None)
-        if name:
-            name = name.lower()
-            queryset = queryset.filter(name__startswith=name)
-        return queryset
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('name'):
+            return ingredients_cache.get_response(request)
+        return self.conditional_response(self.search, request)
+
+    def search(self, request):
+        serializer = self.get_serializer(
+            search_ingredients(request.query_params['name']), many=True
+        )
+        return Response(serializer.data)
 
 
 class MultiSerializerViewSet(ModelViewSet):
@@ -126,73 +215,255 @@ class MultiSerializerViewSet(ModelViewSet):
         return self.serializers.get(self.action)
 
 
-class RecipesViewSet(MultiSerializerViewSet):
+class RecipesViewSet(
+    ConditionalGetMixin, AnonymousListCacheMixin, MultiSerializerViewSet
+):
     queryset = Recipes.objects.all()
     permission_classes = (IsAuthorOrReadOnly,)
-    pagination_class = PageNumberPagination
-    pagination_class.page_size_query_param = 'limit'
+    pagination_class = RecipesPagination
     lookup_field = 'id'
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', 'favorites_count')
     serializers = {
         'list': RecipesSerializer,
         'detail': RecipesSerializer,
         'retrieve': RecipesSerializer,
+        'trending': RecipesSerializer,
+        'feed': RecipesSerializer,
+        'cook': CookRecipesSerializer,
         'create': RecipesCreateSerializer,
         'update': RecipesCreateSerializer,
         'partial_update': RecipesCreateSerializer,
     }
+    etag_versions = ('recipes', 'tags', 'ingredients', 'users')
+    cache_versions = etag_versions
+    counter_ordering_fields = ORDERING_COUNTERS
+
+    def ordered_by_counters(self):
+        ordering = self.request.query_params.get(
+            OrderingFilter.ordering_param, ''
+        )
+        return any(
+            field.strip().lstrip('-') in self.counter_ordering_fields
+            for field in ordering.split(',')
+        )
+
+    def get_etag_versions(self):
+        if self.action == 'retrieve':
+            return ('tags', 'ingredients', 'users')
+        if self.action == 'trending':
+            return self.etag_versions + ('trending',)
+        if self.ordered_by_counters():
+            return self.etag_versions + ('counters',)
+        return self.etag_versions
+
+    def get_cache_versions(self):
+        if self.ordered_by_counters():
+            return self.cache_versions + ('counters',)
+        return self.cache_versions
+
+    def get_etag_parts(self, request):
+        parts = super().get_etag_parts(request)
+        if self.action != 'retrieve':
+            return parts
+        update_date = (
+            Recipes.objects.filter(id=self.kwargs['id'])
+            .values_list('update_date', flat=True)
+            .order_by()
+            .first()
+        )
+        if update_date is None:
+            return None
+        return parts + [update_date.isoformat()]
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Ошибки текстовых выгрузок отдаются в JSON, а не repr словаря."""
+        renderer = getattr(request, 'accepted_renderer', None)
+        if getattr(response, 'exception', False) and (
+            renderer is None or isinstance(renderer, PlainTextRenderer)
+        ):
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in (
+            'list',
+            'retrieve',
+            'trending',
+            'feed',
+            'cook',
+        ):
+            return queryset
+        queryset = queryset.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe',
+                queryset=IngredientAmount.objects.select_related('ingredient'),
+            ),
+        )
+        return self.annotate_user_flags(queryset)
+
+    def annotate_user_flags(self, queryset):
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(
+                FavoriteRecipes.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
 
     @action(
-        detail=True,
-        methods=['POST', 'DELETE'],
+        detail=False,
+        methods=['GET'],
+        pagination_class=PageLimitPagination,
+    )
+    def trending(self, request):
+        """Популярные рецепты в порядке рейтинга из RecipeScore."""
+        return self.conditional_response(self.trending_page, request)
+
+    def trending_page(self, request):
+        queryset = self.filter_queryset(
+            self.get_queryset().filter(score__isnull=False)
+        ).order_by('-score__score', '-score__recipe')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
         permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination,
     )
-    def favorite(self, request, **kwargs):
-        recipe = get_object_or_404(Recipes, pk=kwargs['id'])
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь."""
+        return self.conditional_response(self.feed_page, request)
+
+    def feed_page(self, request):
+        authors = Follow.objects.filter(user=request.user).values(
+            'following_id'
+        )
+        queryset = self.filter_queryset(
+            self.get_queryset().filter(author_id__in=Subquery(authors))
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['GET'])
+    def cook(self, request):
+        """Рецепты, которые можно приготовить из имеющихся ингредиентов."""
+        return self.conditional_response(self.cook_page, request)
+
+    def cook_page(self, request):
+        params = CookQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = search_by_ingredients(
+            self.filter_queryset(self.get_queryset()),
+            params.validated_data['ingredients'],
+            params.validated_data['max_missing'],
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def toggle_recipe(self, request, create, delete, exists_message):
+        """
+        Добавление рецепта в список пользователя или удаление из него.
+        Каждое действие выполняется одним запросом к таблице связи.
+        """
+        recipe = get_object_or_404(
+            Recipes.objects.only(
+                'id', 'name', 'image', 'thumbnail_list', 'cooking_time'
+            ),
+            pk=self.kwargs['id'],
+        )
         user = self.request.user
         if request.method == 'POST':
+            if not create(user.id, [recipe.id]):
+                return Response(
+                    {'error': [exists_message]},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
             serializer = FavoriteSerializer(
-                recipe,
-                data={'user': user, 'recipe': recipe},
-                context={'request': request},
+                recipe, context={'request': request}
             )
-            if serializer.is_valid(raise_exception=True):
-                user.favorite_user.create(recipe=recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if user.favorite_user.filter(recipe=recipe).first():
-            user.favorite_user.get(recipe=recipe).delete()
+        if delete(user.id, [recipe.id]):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'errors': 'Рецепт уже удален'},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
+    @action(
+        detail=True,
+        methods=['POST', 'DELETE'],
+        permission_classes=(IsAuthenticated,),
+    )
+    def favorite(self, request, **kwargs):
+        return self.toggle_recipe(
+            request,
+            add_favorites,
+            remove_favorites,
+            'Рецепт уже есть в избранном',
+        )
+
     @action(
         detail=True,
         methods=['POST', 'DELETE'],
         permission_classes=(IsAuthenticated,),
     )
     def shopping_cart(self, request, **kwargs):
-        recipe = get_object_or_404(Recipes, pk=kwargs['id'])
-        user = self.request.user
-        if request.method == 'POST':
-            serializer = FavoriteSerializer(
-                recipe,
-                data={'user': user, 'recipe': recipe},
-                context={'request': request},
-            )
-            if serializer.is_valid(raise_exception=True):
-                user.shopping_user.create(recipe=recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return self.toggle_recipe(
+            request,
+            add_to_shopping_cart,
+            remove_from_shopping_cart,
+            'Рецепт уже есть в списке покупок',
+        )
 
-        if user.shopping_user.filter(recipe=recipe).first():
-            user.shopping_user.get(recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(
-            {'errors': 'Рецепт уже удален'},
-            status=status.HTTP_400_BAD_REQUEST,
+    def batch_recipes(self, request, create, delete):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found = set(
+            Recipes.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        return get_batch_response(request, ids, found, create, delete)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        permission_classes=(IsAuthenticated,),
+        url_path='favorite',
+        url_name='favorite-batch',
+    )
+    def favorite_batch(self, request):
+        return self.batch_recipes(request, add_favorites, remove_favorites)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        permission_classes=(IsAuthenticated,),
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+    )
+    def shopping_cart_batch(self, request):
+        return self.batch_recipes(
+            request, add_to_shopping_cart, remove_from_shopping_cart
         )
 
     @action(
@@ -200,19 +471,19 @@ class RecipesViewSet(MultiSerializerViewSet):
         methods=['GET'],
         permission_classes=(IsAuthenticated,),
         pagination_class=None,
+        renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer),
     )
     def download_shopping_cart(self, request, **kwargs):
         user = self.request.user
         if not user.shopping_user.exists():
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        ingredients = (
-            IngredientAmount.objects.filter(
-                recipe__shopping_recipes__user=user
-            )
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(amount_sum=Sum('amount'))
-            .order_by('ingredient__name')
+        ingredients = user.shopping_ingredients.values(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            amount_sum=F('amount'),
         )
 
-        return get_shopping_ingredient(ingredients)
+        return get_shopping_ingredient(
+            ingredients, request.accepted_renderer
+        )
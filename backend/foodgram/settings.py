@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -73,6 +74,27 @@ DATABASES = {
     }
 }
 
+# Cache versions live in the recipes_dataversion table, so invalidation
+# reaches every worker and management command. The API only uses the
+# 'responses' cache for anonymous list data; with the LocMem default each
+# worker keeps its own copy, which is correct but not shared. Set
+# RESPONSE_CACHE_BACKEND to a shared backend (Redis, Memcached) to share
+# those responses between processes. 'default' is required by Django but
+# is not used by the API.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': os.getenv(
+            'RESPONSE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+        'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300)),
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -90,7 +112,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'NON_FIELD_ERRORS_KEY': 'error',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageLimitPagination',
     'PAGE_SIZE': 6,
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -136,3 +158,35 @@ DJOSER = {
 # Constant values for limiting fields in the model
 MIN_VALUE = 1
 MAX_VALUE = 32000
+
+# Ingredient autocomplete: result cap and optional in-process prefix index
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 20))
+INGREDIENT_SEARCH_IN_MEMORY = bool(
+    util.strtobool(os.getenv('INGREDIENT_SEARCH_IN_MEMORY', default='False'))
+)
+
+# Maximum number of ids accepted by batch favorite/cart/follow endpoints
+BATCH_MAX_SIZE = 500
+
+# Trending recipes: score = sum of weights halved every half-life hours
+TRENDING_WINDOW_DAYS = int(os.getenv('TRENDING_WINDOW_DAYS', 14))
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 72))
+TRENDING_FAVORITE_WEIGHT = float(os.getenv('TRENDING_FAVORITE_WEIGHT', 1))
+TRENDING_CART_WEIGHT = float(os.getenv('TRENDING_CART_WEIGHT', 2))
+
+# Recipe images are re-encoded on upload; thumbnails map field -> max size
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'WEBP')
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 82))
+IMAGE_MAX_SIZE = (1600, 1600)
+IMAGE_THUMBNAILS = {
+    'thumbnail_list': (480, 480),
+    'thumbnail_detail': (960, 960),
+}
+
+# Limits checked before a base64 image is decoded and before it is unpacked
+IMAGE_MAX_UPLOAD_SIZE = int(os.getenv('IMAGE_MAX_UPLOAD_SIZE', 10 * 1024**2))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+IMAGE_SPOOL_SIZE = 1024**2
+
+# Text search configuration used for the recipe tsvector in PostgreSQL
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
@@ -8,6 +8,12 @@ from recipes.models import (
     ShoppingCart,
     Tag,
 )
+from recipes.images import set_recipe_image
+from recipes.services import (
+    ingredient_amounts_changed,
+    rebuild_carts_with_recipe,
+    refresh_ingredients_count,
+)
 
 
 @admin.register(Ingredient)
@@ -29,21 +35,49 @@ class IngredientAmountInline(admin.TabularInline):
 
 @admin.register(Recipes)
 class RecipesAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'count')
+    list_display = ('name', 'author', 'favorites_count')
     list_filter = ('author', 'name', 'tags')
     search_fields = ('name',)
     filter_horizontal = ('ingredients', 'tags')
     inlines = [IngredientAmountInline]
-
-    @admin.display(description='Количество в избранном')
-    def count(self, recipe):
-        return FavoriteRecipes.objects.filter(recipe=recipe).count()
+    readonly_fields = (
+        'thumbnail_list',
+        'thumbnail_detail',
+        'ingredients_count',
+        'favorites_count',
+        'shopping_count',
+    )
+
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            set_recipe_image(obj, form.cleaned_data['image'])
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_ingredients_count([form.instance.id])
+        if change:
+            rebuild_carts_with_recipe(form.instance.id)
 
 
 @admin.register(IngredientAmount)
 class IngredientAmountAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        recipes = {obj.recipe_id, form.initial.get('recipe')}
+        ingredient_amounts_changed(recipes - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ingredient_amounts_changed([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipes = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        ingredient_amounts_changed(recipes)
+
 
 @admin.register(FavoriteRecipes)
 class FavoriteRecipesAdmin(admin.ModelAdmin):
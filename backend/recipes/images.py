@@ -0,0 +1,57 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def get_image_format():
+    """WebP, если Pillow собран с его поддержкой, иначе JPEG."""
+    if settings.IMAGE_FORMAT == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return settings.IMAGE_FORMAT
+
+
+def encode_image(image, size, image_format):
+    """
+    Уменьшает копию изображения до size с сохранением пропорций
+    и кодирует её заново. EXIF, ICC и прочие метаданные не переносятся.
+    """
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+    if image_format == 'JPEG' or not has_alpha:
+        image = image.convert('RGB')
+    else:
+        image = image.convert('RGBA')
+    buffer = BytesIO()
+    image.save(
+        buffer,
+        format=image_format,
+        quality=settings.IMAGE_QUALITY,
+        optimize=True,
+    )
+    return buffer.getvalue()
+
+
+def set_recipe_image(recipe, file):
+    """
+    Записывает в рецепт фото, уменьшенное до IMAGE_MAX_SIZE,
+    и миниатюры из IMAGE_THUMBNAILS. Файлы сохраняются вместе с рецептом,
+    имена им даёт хранилище по содержимому.
+    """
+    file.seek(0)
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        image_format = get_image_format()
+        extension = EXTENSIONS[image_format]
+        sizes = {'image': settings.IMAGE_MAX_SIZE}
+        sizes.update(settings.IMAGE_THUMBNAILS)
+        for field, size in sizes.items():
+            content = encode_image(image, size, image_format)
+            name = f'{field}.{extension}'
+            setattr(recipe, field, ContentFile(content, name=name))
@@ -0,0 +1,210 @@
+import csv
+import io
+import json
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+
+from recipes.models import Ingredient, Tag
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(frozen=True)
+class Loader:
+    """Модель, её поля в порядке колонок CSV и естественный ключ."""
+
+    model: type
+    columns: tuple
+    key: tuple
+    version: str
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    def get_conflict_sql(self):
+        quote_name = connection.ops.quote_name
+        update = [column for column in self.columns if column not in self.key]
+        conflict = 'ON CONFLICT ({})'.format(
+            ', '.join(quote_name(column) for column in self.key)
+        )
+        if not update:
+            return f'{conflict} DO NOTHING'
+        return '{} DO UPDATE SET {}'.format(
+            conflict,
+            ', '.join(
+                f'{quote_name(column)} = EXCLUDED.{quote_name(column)}'
+                for column in update
+            ),
+        )
+
+
+LOADERS = {
+    'ingredients': Loader(
+        model=Ingredient,
+        columns=('name', 'measurement_unit'),
+        key=('name', 'measurement_unit'),
+        version='ingredients',
+    ),
+    'tags': Loader(
+        model=Tag,
+        columns=('name', 'color', 'slug'),
+        key=('slug',),
+        version='tags',
+    ),
+}
+
+
+def iter_json_array(file):
+    """Объекты JSON-массива по одному, файл читается частями."""
+    decoder = json.JSONDecoder()
+    buffer, position, started = '', 0, False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise ValueError('Ожидался JSON-массив.')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if not chunk:
+                    raise
+                break
+            yield item
+            position = end
+        if not chunk:
+            return
+
+
+def iter_rows(path, loader):
+    """Строки файла .json, .jsonl или .csv в виде кортежей loader.columns."""
+    with open(path, encoding='utf-8', newline='') as file:
+        if path.suffix == '.csv':
+            for row in csv.reader(file):
+                if row:
+                    yield tuple(row[: len(loader.columns)])
+            return
+        if path.suffix == '.jsonl':
+            items = (json.loads(line) for line in file if line.strip())
+        else:
+            items = iter_json_array(file)
+        for item in items:
+            yield tuple(item[column] for column in loader.columns)
+
+
+def iter_batches(rows, loader, size):
+    """Пачки не больше size строк без повторов естественного ключа."""
+    key_positions = [loader.columns.index(column) for column in loader.key]
+    batch = {}
+    for row in rows:
+        batch[tuple(row[position] for position in key_positions)] = row
+        if len(batch) >= size:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+def get_batch_size(loader, size):
+    """Пачка ограничена числом параметров запроса, которое допускает БД."""
+    fields = [loader.model._meta.get_field(name) for name in loader.columns]
+    limit = connection.ops.bulk_batch_size(fields, [None] * size)
+    return max(min(size, limit), 1)
+
+
+def upsert_values(loader, rows):
+    """INSERT ... VALUES ... ON CONFLICT одной командой на пачку."""
+    quote_name = connection.ops.quote_name
+    row_sql = '({})'.format(', '.join(['%s'] * len(loader.columns)))
+    sql = 'INSERT INTO {} ({}) VALUES {} {}'.format(
+        quote_name(loader.table),
+        ', '.join(quote_name(column) for column in loader.columns),
+        ', '.join([row_sql] * len(rows)),
+        loader.get_conflict_sql(),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+class CopyUpserter:
+    """
+    PostgreSQL: пачка загружается COPY во временную таблицу
+    и переносится в основную через INSERT ... SELECT ... ON CONFLICT.
+    """
+
+    temp_table = 'load_rows'
+
+    def __init__(self, loader):
+        self.loader = loader
+        quote_name = connection.ops.quote_name
+        self.columns = ', '.join(
+            quote_name(column) for column in loader.columns
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.temp_table}')
+            cursor.execute(
+                f'CREATE TEMP TABLE {self.temp_table} AS '
+                f'SELECT {self.columns} FROM {quote_name(loader.table)} '
+                'WITH NO DATA'
+            )
+
+    def __call__(self, loader, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {self.temp_table} ({self.columns}) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+            cursor.execute(
+                'INSERT INTO {} ({}) SELECT {} FROM {} {}'.format(
+                    connection.ops.quote_name(loader.table),
+                    self.columns,
+                    self.columns,
+                    self.temp_table,
+                    loader.get_conflict_sql(),
+                )
+            )
+            cursor.execute(f'TRUNCATE {self.temp_table}')
+
+    def close(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.temp_table}')
+
+
+def load_rows(loader, rows, batch_size, use_copy=True, progress=None):
+    """
+    Загружает строки пачками, каждая в своей транзакции, поэтому
+    прерванную загрузку можно просто запустить заново.
+    Возвращает число обработанных строк.
+    """
+    upsert, upserter = upsert_values, None
+    if use_copy and connection.vendor == 'postgresql':
+        upsert = upserter = CopyUpserter(loader)
+    else:
+        batch_size = get_batch_size(loader, batch_size)
+    total = 0
+    try:
+        for batch in iter_batches(rows, loader, batch_size):
+            with transaction.atomic():
+                upsert(loader, batch)
+            total += len(batch)
+            if progress is not None:
+                progress(len(batch))
+    finally:
+        if upserter is not None:
+            upserter.close()
+    return total
@@ -0,0 +1,54 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipes
+from recipes.storage import content_storage
+
+IMAGE_FIELDS = ('image', 'thumbnail_list', 'thumbnail_detail')
+
+
+class Command(BaseCommand):
+    help = 'Удаление файлов рецептов, на которые не ссылается ни один рецепт'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Не трогать файлы моложе указанного числа минут',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено',
+        )
+
+    def handle(self, *args, **options):
+        used = set()
+        for names in Recipes.objects.values_list(*IMAGE_FIELDS).iterator():
+            used.update(name for name in names if name)
+        deadline = time.time() - options['min_age'] * 60
+        removed = size = 0
+        for name in self.walk('food'):
+            path = content_storage.path(name)
+            if name in used or os.path.getmtime(path) > deadline:
+                continue
+            size += os.path.getsize(path)
+            removed += 1
+            if options['dry_run']:
+                print(name)
+            else:
+                content_storage.delete(name)
+        label = 'К удалению' if options['dry_run'] else 'Удалено'
+        print(f'{label} файлов: {removed}, байт: {size}')
+
+    def walk(self, directory):
+        if not content_storage.exists(directory):
+            return
+        directories, files = content_storage.listdir(directory)
+        for name in files:
+            yield f'{directory}/{name}'
+        for name in directories:
+            yield from self.walk(f'{directory}/{name}')
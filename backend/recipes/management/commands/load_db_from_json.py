@@ -1,40 +1,84 @@
-import json
+import time
 from pathlib import Path
 
 from django.core.management.base import BaseCommand, CommandError
 from tqdm import tqdm
 
-from recipes.models import Ingredient, Tag
+from recipes.management.commands._private import LOADERS, iter_rows, load_rows
+from recipes.versions import bump_version
+
+DEFAULT_FILES = ('data/ingredients.json', 'data/tags.json')
+FORMATS = ('.json', '.jsonl', '.csv')
 
 
 class Command(BaseCommand):
-    help = 'Загрузка данных из "data/ingredients.json и data/tags.json"'
+    help = (
+        'Загрузка ингредиентов и тегов из файлов .json, .jsonl и .csv '
+        '(по умолчанию data/ingredients.json и data/tags.json). '
+        'Повторная загрузка не создаёт дублей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            default=DEFAULT_FILES,
+            help='Файлы; модель определяется по имени: ingredients*, tags*',
+        )
+        parser.add_argument(
+            '--model',
+            choices=sorted(LOADERS),
+            help='Модель для всех файлов вместо определения по имени',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одной транзакции',
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY в PostgreSQL',
+        )
 
     def handle(self, *args, **options):
-        data_folder = Path('data/')
-        file_path = {
-            str(p.name).rstrip('.json'): p for p in data_folder.iterdir()
-        }
-        load_same_model = {
-            'ingredient': Ingredient,
-            'tag': Tag,
-        }
+        versions = set()
         try:
-            for name, model in load_same_model.items():
-                print('Модель', name)
-                self.load_data(file_path[name], model)
-            print('Данные успешно импортированы в БД')
+            for path in map(Path, options['paths']):
+                loader = self.get_loader(path, options['model'])
+                self.load_file(path, loader, options)
+                versions.add(loader.version)
+        except CommandError:
+            raise
         except Exception as r:
             raise CommandError('Ошибка загрузки данных', r)
+        finally:
+            if versions:
+                bump_version(*sorted(versions))
+        print('Данные успешно импортированы в БД')
+
+    def get_loader(self, path, model):
+        if path.suffix not in FORMATS:
+            raise CommandError(f'Неизвестный формат файла {path}')
+        name = model or path.stem.split('.')[0].split('_')[0]
+        if name not in LOADERS:
+            raise CommandError(f'Не удалось определить модель для {path}')
+        return LOADERS[name]
 
-    def load_data(self, path, model):
-        with open(path) as file:
-            data = json.load(file)
-            instances = tqdm(data, ncols=80)
-            temp_instances = []
-            for instance in instances:
-                instances.set_description(
-                    f"Загрузка - '{instance['name'][:5]}'"
-                )
-                temp_instances.append(model(**instance))
-            model.objects.bulk_create(temp_instances)
+    def load_file(self, path, loader, options):
+        print('Модель', loader.model._meta.verbose_name_plural, '-', path)
+        started = time.monotonic()
+        with tqdm(unit=' строк', ncols=80) as progress:
+            total = load_rows(
+                loader,
+                iter_rows(path, loader),
+                options['batch_size'],
+                use_copy=not options['no_copy'],
+                progress=progress.update,
+            )
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(
+            f'Загружено строк: {total} за {elapsed:.1f} с '
+            f'({total / elapsed:.0f} строк/с)'
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков избранного, покупок, подписчиков и рецептов'
+
+    def handle(self, *args, **options):
+        rebuild_counters()
+        print('Счётчики пересчитаны')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import refresh_trending_scores
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт рейтинга популярных рецептов'
+
+    def handle(self, *args, **options):
+        count = refresh_trending_scores()
+        print(f'Рейтинг пересчитан для {count} рецептов')
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:10
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+CREATE_TRIGRAM_INDEX = (
+    'CREATE INDEX IF NOT EXISTS ingredient_name_trgm_idx '
+    'ON recipes_ingredient USING gin (name gin_trgm_ops)'
+)
+DROP_TRIGRAM_INDEX = 'DROP INDEX IF EXISTS ingredient_name_trgm_idx'
+
+
+def run_on_postgresql(sql):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['name'], name='ingredient_name_prefix_idx', opclasses=['text_pattern_ops']),
+        ),
+        TrigramExtension(),
+        migrations.RunPython(
+            run_on_postgresql(CREATE_TRIGRAM_INDEX),
+            run_on_postgresql(DROP_TRIGRAM_INDEX),
+        ),
+    ]
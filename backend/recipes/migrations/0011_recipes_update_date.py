@@ -0,0 +1,20 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_ingredient_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='update_date',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата изменения рецепта'),
+            preserve_default=False,
+        ),
+    ]
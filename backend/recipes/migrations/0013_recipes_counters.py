@@ -0,0 +1,55 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:19
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(
+        models.Subquery(
+            model.objects.filter(**{field: models.OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=models.Count('id'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipes = apps.get_model('recipes', 'Recipes')
+    FavoriteRecipes = apps.get_model('recipes', 'FavoriteRecipes')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    Recipes.objects.update(
+        favorites_count=count_of(FavoriteRecipes, 'recipe'),
+        shopping_count=count_of(ShoppingCart, 'recipe'),
+    )
+    User.objects.update(
+        followers_count=count_of(Follow, 'following'),
+        recipes_count=count_of(Recipes, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_counters'),
+        ('recipes', '0012_recipes_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='favorites_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='Количество в избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipes',
+            name='shopping_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество в списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
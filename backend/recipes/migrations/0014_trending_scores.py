@@ -0,0 +1,48 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:26
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Existing rows get a date outside any trending window: their real
+# creation time is unknown and must not count as fresh activity.
+BACKFILL_CREATED = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipes_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipes', verbose_name='Рецепт')),
+                ('score', models.FloatField(help_text='Избранное и покупки с затуханием по времени', verbose_name='Рейтинг')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+                'ordering': ['-score'],
+            },
+        ),
+        migrations.AddField(
+            model_name='favoriterecipes',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=BACKFILL_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=BACKFILL_CREATED, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-score', '-recipe'], name='recipe_score_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_trending_scores'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipes',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipes_author_pub_date_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_recipes_author_pub_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='thumbnail_detail',
+            field=models.ImageField(blank=True, upload_to='food/detail/', verbose_name='Миниатюра для страницы рецепта'),
+        ),
+        migrations.AddField(
+            model_name='recipes',
+            name='thumbnail_list',
+            field=models.ImageField(blank=True, upload_to='food/list/', verbose_name='Миниатюра для списка'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:30
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipes_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipes',
+            name='image',
+            field=models.ImageField(help_text='Фото рецепта', storage=recipes.storage.ContentAddressedStorage(), upload_to='food/', verbose_name='Фото'),
+        ),
+        migrations.AlterField(
+            model_name='recipes',
+            name='thumbnail_detail',
+            field=models.ImageField(blank=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='food/detail/', verbose_name='Миниатюра для страницы рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='recipes',
+            name='thumbnail_list',
+            field=models.ImageField(blank=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='food/list/', verbose_name='Миниатюра для списка'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:31
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+FILL_SEARCH_VECTOR = (
+    "UPDATE recipes_recipes SET search_vector = "
+    "setweight(to_tsvector(%s::regconfig, coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector(%s::regconfig, coalesce(text, '')), 'B')"
+)
+CREATE_SEARCH_INDEX = (
+    'CREATE INDEX IF NOT EXISTS recipes_search_vector_idx '
+    'ON recipes_recipes USING gin (search_vector)'
+)
+DROP_SEARCH_INDEX = 'DROP INDEX IF EXISTS recipes_search_vector_idx'
+
+
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        config = settings.SEARCH_CONFIG
+        schema_editor.execute(FILL_SEARCH_VECTOR, [config, config])
+        schema_editor.execute(CREATE_SEARCH_INDEX)
+
+
+def run_on_postgresql(*sql):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in sql:
+                schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipes_content_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(
+            fill_search_vector,
+            run_on_postgresql(DROP_SEARCH_INDEX),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_recipes_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ingredientamount',
+            index=models.Index(fields=['ingredient', 'recipe'], name='amount_ingredient_recipe_idx'),
+        ),
+    ]
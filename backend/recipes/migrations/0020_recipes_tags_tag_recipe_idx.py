@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_amount_ingredient_recipe_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS recipes_tags_tag_recipe_idx '
+            'ON recipes_recipes_tags (tag_id, recipes_id)',
+            'DROP INDEX IF EXISTS recipes_tags_tag_recipe_idx',
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:34
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_ingredients_count(apps, schema_editor):
+    Recipes = apps.get_model('recipes', 'Recipes')
+    IngredientAmount = apps.get_model('recipes', 'IngredientAmount')
+    Recipes.objects.update(
+        ingredients_count=Coalesce(
+            models.Subquery(
+                IngredientAmount.objects.filter(recipe=models.OuterRef('pk'))
+                .order_by()
+                .values('recipe')
+                .annotate(total=models.Count('id'))
+                .values('total')
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_recipes_tags_tag_recipe_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='ingredients_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Количество ингредиентов'),
+        ),
+        migrations.RunPython(
+            fill_ingredients_count, migrations.RunPython.noop
+        ),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=models.Index(fields=['cooking_time', 'ingredients_count'], name='recipes_cooking_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=models.Index(fields=['ingredients_count', 'cooking_time'], name='recipes_ingredients_count_idx'),
+        ),
+    ]
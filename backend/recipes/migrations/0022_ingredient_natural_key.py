@@ -0,0 +1,101 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def merge_into(model, keep, duplicate, owner, max_amount=None):
+    """
+    Переносит строки model с ингредиента duplicate на keep.
+    Возвращает значения owner, у которых строка была слита с существующей.
+    Сумма количеств ограничивается max_amount, об обрезке сообщается.
+    """
+    merged = set()
+    for row in model.objects.filter(ingredient_id=duplicate):
+        existing = model.objects.filter(
+            ingredient_id=keep, **{owner: getattr(row, owner)}
+        ).first()
+        if existing is None:
+            row.ingredient_id = keep
+            row.save(update_fields=['ingredient'])
+            continue
+        amount = existing.amount + row.amount
+        if max_amount is not None and amount > max_amount:
+            print(
+                f'\n  {model.__name__} {owner}={getattr(row, owner)}, '
+                f'ингредиент {keep}: количество {amount} '
+                f'обрезано до {max_amount}'
+            )
+            amount = max_amount
+        existing.amount = amount
+        existing.save(update_fields=['amount'])
+        row.delete()
+        merged.add(getattr(row, owner))
+    return merged
+
+
+def refresh_ingredients_count(Recipes, IngredientAmount, recipe_ids):
+    """Пересчитывает ingredients_count рецептов по IngredientAmount."""
+    Recipes.objects.filter(id__in=recipe_ids).update(
+        ingredients_count=Coalesce(
+            models.Subquery(
+                IngredientAmount.objects.filter(recipe=models.OuterRef('pk'))
+                .order_by()
+                .values('recipe')
+                .annotate(total=models.Count('id'))
+                .values('total')
+            ),
+            0,
+        )
+    )
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientAmount = apps.get_model('recipes', 'IngredientAmount')
+    Recipes = apps.get_model('recipes', 'Recipes')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient'
+    )
+    duplicates = (
+        Ingredient.objects.order_by()
+        .values('name', 'measurement_unit')
+        .annotate(keep=models.Min('id'), total=models.Count('id'))
+        .filter(total__gt=1)
+    )
+    merged_recipes = set()
+    for group in duplicates:
+        extra = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep'])
+        for duplicate in extra.values_list('id', flat=True):
+            merged_recipes |= merge_into(
+                IngredientAmount,
+                group['keep'],
+                duplicate,
+                'recipe_id',
+                max_amount=settings.MAX_VALUE,
+            )
+            merge_into(
+                ShoppingCartIngredient, group['keep'], duplicate, 'user_id'
+            )
+        extra.delete()
+    refresh_ingredients_count(Recipes, IngredientAmount, merged_recipes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_recipes_ingredients_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_name_unit'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (
     MaxValueValidator,
     MinValueValidator,
@@ -6,7 +7,8 @@ from django.core.validators import (
 )
 from django.db import models
 
-from users.models import User
+from recipes.storage import content_storage
+from users.models import CountersModelMixin, User
 
 
 class Ingredient(models.Model):
@@ -27,6 +29,19 @@ class Ingredient(models.Model):
         ordering = ['-id']
         verbose_name = 'Ингридиент'
         verbose_name_plural = 'Ингридиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_name_unit',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['name'],
+                name='ingredient_name_prefix_idx',
+                opclasses=['text_pattern_ops'],
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -62,7 +77,9 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipes(models.Model):
+class Recipes(CountersModelMixin, models.Model):
+    counter_fields = ('favorites_count', 'shopping_count', 'ingredients_count')
+
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
@@ -82,8 +99,21 @@ class Recipes(models.Model):
         verbose_name='Фото',
         help_text='Фото рецепта',
         upload_to='food/',
+        storage=content_storage,
         blank=False,
     )
+    thumbnail_list = models.ImageField(
+        verbose_name='Миниатюра для списка',
+        upload_to='food/list/',
+        storage=content_storage,
+        blank=True,
+    )
+    thumbnail_detail = models.ImageField(
+        verbose_name='Миниатюра для страницы рецепта',
+        upload_to='food/detail/',
+        storage=content_storage,
+        blank=True,
+    )
     text = models.TextField(
         verbose_name='Описание',
         help_text='Описание рецепта',
@@ -115,11 +145,50 @@ class Recipes(models.Model):
         auto_now_add=True,
         db_index=True,
     )
+    update_date = models.DateTimeField(
+        verbose_name='Дата изменения рецепта',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество в избранном',
+        default=0,
+        db_index=True,
+    )
+    shopping_count = models.PositiveIntegerField(
+        verbose_name='Количество в списках покупок',
+        default=0,
+    )
+    ingredients_count = models.PositiveSmallIntegerField(
+        verbose_name='Количество ингредиентов',
+        default=0,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipes_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipes_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['cooking_time', 'ingredients_count'],
+                name='recipes_cooking_time_idx',
+            ),
+            models.Index(
+                fields=['ingredients_count', 'cooking_time'],
+                name='recipes_ingredients_count_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -157,6 +226,12 @@ class IngredientAmount(models.Model):
                 name='unique_ingredient',
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='amount_ingredient_recipe_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.ingredient
@@ -176,6 +251,11 @@ class FavoriteRecipes(models.Model):
         related_name='favorite_recipes',
         verbose_name='Рецепты',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         ordering = ['-id']
@@ -206,6 +286,11 @@ class ShoppingCart(models.Model):
         related_name='shopping_recipes',
         verbose_name='Рецепты',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True,
+    )
 
     class Meta:
         ordering = ['-id']
@@ -220,3 +305,92 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил в список покупок - {self.recipe}'
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_ingredients',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_ingredients',
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+        help_text='Суммарное количество ингредиента',
+    )
+
+    class Meta:
+        ordering = ['ingredient__name']
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='shopping_cart_ingredient',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+class RecipeScore(models.Model):
+    """Рейтинг популярности рецепта, пересчитывается командой."""
+
+    recipe = models.OneToOneField(
+        Recipes,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Рейтинг',
+        help_text='Избранное и покупки с затуханием по времени',
+    )
+
+    class Meta:
+        ordering = ['-score']
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(
+                fields=['-score', '-recipe'], name='recipe_score_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}: {self.score:.2f}'
+
+
+class DataVersion(models.Model):
+    """
+    Версия набора данных для кэшей и ETag. Хранится в БД, поэтому
+    изменение в одном процессе видят все процессы сервера
+    и команды управления.
+    """
+
+    name = models.CharField(
+        verbose_name='Набор данных',
+        max_length=64,
+        primary_key=True,
+    )
+    version = models.CharField(
+        verbose_name='Версия',
+        max_length=32,
+    )
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
@@ -0,0 +1,319 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, TruncHour
+from django.utils import timezone
+
+from recipes.models import (
+    FavoriteRecipes,
+    IngredientAmount,
+    Recipes,
+    RecipeScore,
+    ShoppingCart,
+    ShoppingCartIngredient,
+)
+from recipes.versions import bump_version, user_version
+from users.models import Follow, User
+
+# Счётчики, по которым можно сортировать списки рецептов
+ORDERING_COUNTERS = ('favorites_count',)
+
+UPSERT_CART_INGREDIENTS_SQL = '''
+    INSERT INTO {cart} (user_id, ingredient_id, amount)
+    SELECT shopping.user_id, amount.ingredient_id, SUM(amount.amount)
+    FROM {amount} amount
+    JOIN {shopping} shopping ON shopping.recipe_id = amount.recipe_id
+    WHERE {where}
+    GROUP BY shopping.user_id, amount.ingredient_id
+    ON CONFLICT (user_id, ingredient_id)
+    DO UPDATE SET amount = {cart}.amount + EXCLUDED.amount
+'''
+
+
+def upsert_cart_ingredients(where, params):
+    """Добавляет в сводные списки покупок ингредиенты отобранных рецептов."""
+    sql = UPSERT_CART_INGREDIENTS_SQL.format(
+        cart=ShoppingCartIngredient._meta.db_table,
+        amount=IngredientAmount._meta.db_table,
+        shopping=ShoppingCart._meta.db_table,
+        where=where,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def add_recipes_to_cart(user_id, recipe_ids):
+    upsert_cart_ingredients(
+        'shopping.user_id = %s AND shopping.recipe_id IN ({})'.format(
+            placeholders(recipe_ids)
+        ),
+        [user_id, *recipe_ids],
+    )
+
+
+def remove_recipes_from_cart(user_id, recipe_ids):
+    amounts = (
+        IngredientAmount.objects.filter(
+            recipe_id__in=recipe_ids, ingredient=OuterRef('ingredient')
+        )
+        .order_by()
+        .values('ingredient')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    with transaction.atomic():
+        ShoppingCartIngredient.objects.filter(
+            user_id=user_id,
+            ingredient__ingredient__recipe_id__in=recipe_ids,
+        ).update(amount=Greatest(F('amount') - Subquery(amounts), 0))
+        ShoppingCartIngredient.objects.filter(
+            user_id=user_id, amount__lte=0
+        ).delete()
+
+
+def rebuild_carts_with_recipe(recipe_id):
+    """Пересчитывает списки покупок всех, у кого в корзине есть рецепт."""
+    users = ShoppingCart.objects.filter(recipe_id=recipe_id).values('user')
+    where = (
+        'shopping.user_id IN (SELECT user_id FROM {} WHERE recipe_id = %s)'
+    ).format(ShoppingCart._meta.db_table)
+    with transaction.atomic():
+        ShoppingCartIngredient.objects.filter(user__in=users).delete()
+        upsert_cart_ingredients(where, [recipe_id])
+
+
+def get_search_vector():
+    return SearchVector(
+        'name', weight='A', config=settings.SEARCH_CONFIG
+    ) + SearchVector('text', weight='B', config=settings.SEARCH_CONFIG)
+
+
+def update_search_vector(recipe_ids):
+    """Пересчитывает search_vector рецептов; только для PostgreSQL."""
+    if connection.vendor == 'postgresql':
+        Recipes.objects.filter(id__in=recipe_ids).update(
+            search_vector=get_search_vector()
+        )
+
+
+def change_counter(model, ids, field, delta):
+    """
+    Изменяет счётчик field у объектов ids на delta одним UPDATE.
+    Версия counters сбрасывается только для счётчиков из ORDERING_COUNTERS:
+    от остальных порядок списков не зависит.
+    """
+    if ids:
+        model.objects.filter(id__in=ids).update(
+            **{field: Greatest(F(field) + delta, 0)}
+        )
+        if field in ORDERING_COUNTERS:
+            bump_version('counters')
+
+
+def count_of(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('id'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def refresh_ingredients_count(recipe_ids):
+    """Пересчитывает ingredients_count рецептов по IngredientAmount."""
+    Recipes.objects.filter(id__in=recipe_ids).update(
+        ingredients_count=count_of(IngredientAmount, 'recipe')
+    )
+
+
+def ingredient_amounts_changed(recipe_ids):
+    """
+    Для правок IngredientAmount в обход формы рецепта: обновляет
+    update_date и ingredients_count рецептов, их версию и списки покупок.
+    """
+    recipe_ids = list(recipe_ids)
+    Recipes.objects.filter(id__in=recipe_ids).update(
+        update_date=timezone.now(),
+        ingredients_count=count_of(IngredientAmount, 'recipe'),
+    )
+    bump_version('recipes')
+    for recipe_id in recipe_ids:
+        rebuild_carts_with_recipe(recipe_id)
+
+
+@transaction.atomic
+def rebuild_counters():
+    """Пересчитывает все счётчики по таблицам связей."""
+    Recipes.objects.update(
+        favorites_count=count_of(FavoriteRecipes, 'recipe'),
+        shopping_count=count_of(ShoppingCart, 'recipe'),
+        ingredients_count=count_of(IngredientAmount, 'recipe'),
+    )
+    bump_version('counters')
+    User.objects.update(
+        followers_count=count_of(Follow, 'following'),
+        recipes_count=count_of(Recipes, 'author'),
+    )
+
+
+def get_trending_scores(now):
+    """
+    Рейтинг рецептов за последние TRENDING_WINDOW_DAYS дней.
+    Каждое добавление в избранное или список покупок даёт свой вес,
+    который уменьшается вдвое каждые TRENDING_HALF_LIFE_HOURS часов.
+    События группируются в БД по рецепту и часу.
+    """
+    since = now - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+    half_life = settings.TRENDING_HALF_LIFE_HOURS
+    sources = (
+        (FavoriteRecipes, settings.TRENDING_FAVORITE_WEIGHT),
+        (ShoppingCart, settings.TRENDING_CART_WEIGHT),
+    )
+    scores = defaultdict(float)
+    for model, weight in sources:
+        events = (
+            model.objects.filter(created__gte=since)
+            .order_by()
+            .values('recipe_id', hour=TruncHour('created'))
+            .annotate(total=Count('id'))
+            .values_list('recipe_id', 'hour', 'total')
+        )
+        for recipe_id, hour, total in events.iterator(chunk_size=2000):
+            age = max((now - hour).total_seconds() / 3600, 0)
+            scores[recipe_id] += weight * total * 0.5 ** (age / half_life)
+    return scores
+
+
+def refresh_trending_scores(now=None):
+    """Перезаписывает таблицу RecipeScore, возвращает число рецептов."""
+    scores = get_trending_scores(now or timezone.now())
+    with transaction.atomic():
+        RecipeScore.objects.all().delete()
+        RecipeScore.objects.bulk_create(
+            (
+                RecipeScore(recipe_id=recipe_id, score=score)
+                for recipe_id, score in scores.items()
+            ),
+            batch_size=1000,
+        )
+        bump_version('trending')
+    return len(scores)
+
+
+def insert_ignore(model, user_id, field, ids):
+    """
+    INSERT ... ON CONFLICT DO NOTHING одним запросом.
+    Возвращает значения field добавленных строк. Сигналы не вызываются.
+    Поле created, если оно есть у модели, заполняется текущим временем.
+    """
+    if not ids:
+        return []
+    quote_name = connection.ops.quote_name
+    columns = ['user_id', field]
+    extra = []
+    if any(f.name == 'created' for f in model._meta.concrete_fields):
+        columns.append('created')
+        extra.append(timezone.now())
+    row = '({})'.format(placeholders(columns))
+    sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING'
+    sql = sql.format(
+        quote_name(model._meta.db_table),
+        ', '.join(quote_name(column) for column in columns),
+        ', '.join([row] * len(ids)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{sql} RETURNING {quote_name(field)}',
+            [value for pk in ids for value in (user_id, pk, *extra)],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_returning(model, user_id, field, ids):
+    """
+    DELETE ... RETURNING одним запросом.
+    Возвращает значения field удалённых строк. Сигналы не вызываются.
+    """
+    if not ids:
+        return []
+    quote_name = connection.ops.quote_name
+    sql = 'DELETE FROM {} WHERE user_id = %s AND {} IN ({}) RETURNING {}'
+    sql = sql.format(
+        quote_name(model._meta.db_table),
+        quote_name(field),
+        placeholders(ids),
+        quote_name(field),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, *ids])
+        return [row[0] for row in cursor.fetchall()]
+
+
+@transaction.atomic
+def add_favorites(user_id, recipe_ids):
+    created = insert_ignore(FavoriteRecipes, user_id, 'recipe_id', recipe_ids)
+    if created:
+        change_counter(Recipes, created, 'favorites_count', 1)
+        bump_version(user_version(user_id))
+    return created
+
+
+@transaction.atomic
+def remove_favorites(user_id, recipe_ids):
+    deleted = delete_returning(
+        FavoriteRecipes, user_id, 'recipe_id', recipe_ids
+    )
+    if deleted:
+        change_counter(Recipes, deleted, 'favorites_count', -1)
+        bump_version(user_version(user_id))
+    return deleted
+
+
+@transaction.atomic
+def add_to_shopping_cart(user_id, recipe_ids):
+    created = insert_ignore(ShoppingCart, user_id, 'recipe_id', recipe_ids)
+    if created:
+        add_recipes_to_cart(user_id, created)
+        change_counter(Recipes, created, 'shopping_count', 1)
+        bump_version(user_version(user_id))
+    return created
+
+
+@transaction.atomic
+def remove_from_shopping_cart(user_id, recipe_ids):
+    deleted = delete_returning(ShoppingCart, user_id, 'recipe_id', recipe_ids)
+    if deleted:
+        remove_recipes_from_cart(user_id, deleted)
+        change_counter(Recipes, deleted, 'shopping_count', -1)
+        bump_version(user_version(user_id))
+    return deleted
+
+
+@transaction.atomic
+def add_follows(user_id, author_ids):
+    created = insert_ignore(Follow, user_id, 'following_id', author_ids)
+    if created:
+        change_counter(User, created, 'followers_count', 1)
+        bump_version(user_version(user_id))
+    return created
+
+
+@transaction.atomic
+def remove_follows(user_id, author_ids):
+    deleted = delete_returning(Follow, user_id, 'following_id', author_ids)
+    if deleted:
+        change_counter(User, deleted, 'followers_count', -1)
+        bump_version(user_version(user_id))
+    return deleted
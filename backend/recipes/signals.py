@@ -0,0 +1,107 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from recipes.models import (
+    FavoriteRecipes,
+    Ingredient,
+    Recipes,
+    ShoppingCart,
+    Tag,
+)
+from recipes.services import (
+    add_recipes_to_cart,
+    change_counter,
+    remove_recipes_from_cart,
+    update_search_vector,
+)
+from recipes.versions import bump_version, user_version
+from users.models import Follow, User
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_added(sender, instance, created, **kwargs):
+    if created:
+        add_recipes_to_cart(instance.user_id, [instance.recipe_id])
+        change_counter(Recipes, [instance.recipe_id], 'shopping_count', 1)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_cart_removed(sender, instance, **kwargs):
+    remove_recipes_from_cart(instance.user_id, [instance.recipe_id])
+    change_counter(Recipes, [instance.recipe_id], 'shopping_count', -1)
+
+
+@receiver(post_save, sender=FavoriteRecipes)
+def favorite_added(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipes, [instance.recipe_id], 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipes)
+def favorite_removed(sender, instance, **kwargs):
+    change_counter(Recipes, [instance.recipe_id], 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_added(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, [instance.following_id], 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_removed(sender, instance, **kwargs):
+    change_counter(User, [instance.following_id], 'followers_count', -1)
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_added(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, [instance.author_id], 'recipes_count', 1)
+    update_search_vector([instance.id])
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_removed(sender, instance, **kwargs):
+    change_counter(User, [instance.author_id], 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_version('tags')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    bump_version('ingredients')
+
+
+@receiver(post_save, sender=Recipes)
+@receiver(post_delete, sender=Recipes)
+@receiver(m2m_changed, sender=Recipes.tags.through)
+def recipe_changed(sender, **kwargs):
+    bump_version('recipes')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    bump_version('users')
+
+
+@receiver(post_save, sender=FavoriteRecipes)
+@receiver(post_delete, sender=FavoriteRecipes)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def user_relations_changed(sender, instance, **kwargs):
+    bump_version(user_version(instance.user_id))
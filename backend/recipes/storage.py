@@ -0,0 +1,40 @@
+import os
+from hashlib import sha256
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Имя файла — SHA-256 его содержимого: <каталог>/<ab>/<abcd...>.<ext>.
+    Одинаковые файлы хранятся один раз, а содержимое по имени никогда
+    не меняется, поэтому его можно кэшировать навсегда.
+    Неиспользуемые файлы удаляет команда clean_media.
+    """
+
+    chunk_size = 64 * 1024
+
+    def get_content_hash(self, content):
+        digest = sha256()
+        content.seek(0)
+        for chunk in content.chunks(self.chunk_size):
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        content_hash = self.get_content_hash(content)
+        name = os.path.join(
+            directory, content_hash[:2], content_hash + extension
+        )
+        if self.exists(name):
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
+
+
+content_storage = ContentAddressedStorage()
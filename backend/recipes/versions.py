@@ -0,0 +1,49 @@
+from uuid import uuid4
+
+from django.db import connection, transaction
+
+from recipes.models import DataVersion
+
+INITIAL_VERSION = 'initial'
+BUMP_VERSIONS_SQL = '''
+    INSERT INTO {table} (name, version) VALUES {values}
+    ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version
+'''
+
+
+def get_versions(*names):
+    """Текущие версии наборов данных одним запросом к БД."""
+    found = dict(
+        DataVersion.objects.filter(name__in=names).values_list(
+            'name', 'version'
+        )
+    )
+    return [found.get(name, INITIAL_VERSION) for name in names]
+
+
+def get_version(name):
+    """Текущая версия набора данных; меняется при каждом его изменении."""
+    return get_versions(name)[0]
+
+
+def bump_version(*names):
+    """Сбрасывает версии наборов данных после фиксации транзакции."""
+    names = tuple(dict.fromkeys(names))
+
+    def bump():
+        sql = BUMP_VERSIONS_SQL.format(
+            table=connection.ops.quote_name(DataVersion._meta.db_table),
+            values=', '.join(['(%s, %s)'] * len(names)),
+        )
+        params = [
+            value for name in names for value in (name, uuid4().hex)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    transaction.on_commit(bump)
+
+
+def user_version(user_id):
+    """Имя версии данных, зависящих от пользователя: избранное, подписки."""
+    return f'user-{user_id}'
@@ -5,7 +5,15 @@ from .models import Follow, User
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'email', 'date_joined', 'is_admin')
+    list_display = (
+        'username',
+        'email',
+        'date_joined',
+        'is_admin',
+        'followers_count',
+        'recipes_count',
+    )
+    readonly_fields = ('followers_count', 'recipes_count')
     list_filter = ('username', 'email')
     search_fields = ('username', 'email')
 
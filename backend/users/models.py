@@ -7,8 +7,35 @@ class Role(models.TextChoices):
     ADMIN = 'admin'
 
 
-class User(AbstractUser):
+class CountersModelMixin:
+    """
+    Поля counter_fields меняются только отдельными UPDATE с F().
+    Обычный save существующей строки их не записывает, чтобы не затереть
+    значения, изменённые параллельными транзакциями.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            skipped = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersModelMixin, AbstractUser):
     USERNAME_FIELD = 'email'
+    counter_fields = ('followers_count', 'recipes_count')
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 
     email = models.EmailField(max_length=254, unique=True, null=False)
@@ -21,6 +48,15 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=150, blank=False, null=False)
     last_name = models.CharField(max_length=150, blank=False, null=False)
 
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчики',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Рецепты',
+    )
+
     role = models.CharField(
         max_length=254,
         choices=Role.choices,
@@ -39,6 +75,11 @@ class User(AbstractUser):
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ['username']
+        indexes = [
+            models.Index(
+                fields=['username', 'id'], name='user_username_id_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.username